@@ -0,0 +1,210 @@
+"""Offline benchmarks for parsing and message rendering.
+
+Runs on saved pages from `bench/fixtures`, no network is used.
+`python bench/bench.py` - run and compare with `bench/baseline.json`, exits with 1 on regression
+`python bench/bench.py --save` - run and save results as new baseline
+`python bench/bench.py --record` - download fresh fixtures from the site (needs config.json and network)
+"""
+import os, sys, json, time, argparse, tracemalloc
+from typing import Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import kitis_api as api
+import messages
+
+FIXTURES = os.path.join(ROOT, "bench", "fixtures")
+BASELINE = os.path.join(ROOT, "bench", "baseline.json")
+BASE = "http://94.72.18.202:8083/"
+
+# fixture file for every page benchmarks request
+fixture_files = {
+    "s_group":      "cg.htm",
+    "s_lecturer":   "cp.htm",
+    "s_room":       "ca.htm",
+    "group":        "group.htm",
+    "lecturer":     "lecturer.htm",
+    "room":         "room.htm"
+}
+
+class FixtureResponse:
+    """Looks like requests.Response for api functions"""
+    status_code = 200
+    ok = True
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+# benchmark cases, name -> function without arguments
+cases: dict = dict()
+
+def case(name: str):
+    def decorator(func: Callable[[], object]):
+        cases[name] = func
+        return func
+    return decorator
+
+def load_fixtures() -> dict:
+    pages = dict()
+    for key, filename in fixture_files.items():
+        with open(os.path.join(FIXTURES, filename), "rb") as f:
+            pages[key] = f.read()
+    return pages
+
+def setup_api(pages: dict) -> None:
+    """Point api to fixtures instead of the site"""
+    api.config = {"links": {"base": BASE}}
+    by_link = dict()
+    for key in ("s_group", "s_lecturer", "s_room"):
+        link = f"{BASE}{fixture_files[key]}"
+        api.config["links"][key] = link
+        by_link[link] = pages[key]
+    # every source of each type points to its sample page
+    for source_type in ("group", "lecturer", "room"):
+        links = api.parse_links_page(pages[f"s_{source_type}"])
+        link = f"{BASE}{fixture_files[source_type]}"
+        api.links[f"s_{source_type}"] = {name: link for name in links}
+        by_link[link] = pages[source_type]
+    api.try_request = lambda link: FixtureResponse(by_link[link])
+
+def register_cases(pages: dict) -> None:
+    from bs4 import BeautifulSoup
+
+    for backend in ("fast", "bs4"):
+        def links_case(backend=backend):
+            api.parser_backend = backend
+            api.get_source_links("s_lecturer")
+        case(f"get_source_links[{backend}]")(links_case)
+
+    case("parse_soup_schedule")(lambda: api.parse_soup_schedule(BeautifulSoup(pages["group"], "html.parser")))
+
+    for source_type in ("group", "lecturer", "room"):
+        source = next(iter(api.links[f"s_{source_type}"]))
+        for backend in ("fast", "bs4"):
+            def fetch_case(source_type=source_type, source=source, backend=backend):
+                api.parser_backend = backend
+                api.fetch_schedule(source_type, source)
+            case(f"fetch_schedule[{source_type},{backend}]")(fetch_case)
+
+        data = api.fetch_schedule(source_type, source)
+        case(f"format_schedule[{source_type}]")(lambda source_type=source_type, data=data: messages.format_schedule(source_type, data))
+        case(f"render_schedule[{source_type},cached]")(lambda source_type=source_type, data=data: messages.render_schedule(source_type, data))
+
+    # cached path of get_schedule
+    source = next(iter(api.links["s_group"]))
+    api.get_schedule("group", source)
+    case("get_schedule[cached]")(lambda: api.get_schedule("group", source))
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def run_case(func: Callable[[], object], min_time: float, min_runs: int) -> dict:
+    # warmup
+    func()
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < min_runs or time.perf_counter() - started < min_time:
+        t = time.perf_counter_ns()
+        func()
+        timings.append(time.perf_counter_ns() - t)
+    total = time.perf_counter() - started
+
+    # peak memory is measured separately, tracemalloc slows everything down
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "runs":     len(timings),
+        "ops":      len(timings) / total,
+        "p50":      percentile(timings, 0.50) / 1e6,
+        "p95":      percentile(timings, 0.95) / 1e6,
+        "p99":      percentile(timings, 0.99) / 1e6,
+        "peak_kb":  peak / 1024
+    }
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns list of regressions, p50 latency and peak memory are compared"""
+    regressions = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        # tiny absolute differences are just noise
+        if r["p50"] > b["p50"] * (1 + tolerance) and r["p50"] - b["p50"] > 0.01:
+            regressions.append(f"{name}: p50 {b['p50']:.3f} -> {r['p50']:.3f} ms")
+        if r["peak_kb"] > b["peak_kb"] * (1 + tolerance) and r["peak_kb"] - b["peak_kb"] > 1:
+            regressions.append(f"{name}: peak {b['peak_kb']:.1f} -> {r['peak_kb']:.1f} KiB")
+    return regressions
+
+def record() -> None:
+    """Save current pages from the site as fixtures"""
+    import logger
+    logger.init_logger("log.log")
+    os.chdir(ROOT)
+    api.init_api()
+    for key in ("s_group", "s_lecturer", "s_room"):
+        pages = {key: api.try_request(api.config["links"][key])}
+        source_type = key[2:]
+        first_link = next(iter(api.links[key].values()))
+        pages[source_type] = api.try_request(first_link)
+        for name, r in pages.items():
+            if not r:
+                sys.exit(f"Could not download {name}")
+            with open(os.path.join(FIXTURES, fixture_files[name]), "wb") as f:
+                f.write(r.content)
+    print("Fixtures updated")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for parsing and rendering")
+    parser.add_argument("--save", action="store_true", help="save results as new baseline")
+    parser.add_argument("--record", action="store_true", help="download fresh fixtures from the site")
+    parser.add_argument("--filter", default="", help="run only cases containing this string")
+    parser.add_argument("--time", type=float, default=1.0, help="minimal time per case, seconds")
+    parser.add_argument("--runs", type=int, default=20, help="minimal runs per case")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against baseline")
+    args = parser.parse_args()
+
+    if args.record:
+        record()
+        return
+
+    pages = load_fixtures()
+    setup_api(pages)
+    register_cases(pages)
+
+    baseline = dict()
+    if os.path.exists(BASELINE):
+        with open(BASELINE, "r") as f:
+            baseline = json.load(f)
+
+    results = dict()
+    print(f"{'case':<36}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak KiB':>10}{'vs base':>9}")
+    for name, func in cases.items():
+        if args.filter not in name:
+            continue
+        r = run_case(func, args.time, args.runs)
+        results[name] = r
+        b = baseline.get(name)
+        delta = f"{(r['p50'] / b['p50'] - 1) * 100:+.0f}%" if b else "---"
+        print(f"{name:<36}{r['ops']:>10.1f}{r['p50']:>10.3f}{r['p95']:>10.3f}{r['p99']:>10.3f}{r['peak_kb']:>10.1f}{delta:>9}")
+
+    if args.save:
+        baseline.update(results)
+        with open(BASELINE, "w") as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print(f"Baseline saved: {BASELINE}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
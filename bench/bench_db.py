@@ -0,0 +1,77 @@
+"""Database write benchmark.
+
+Compares old way of writing (rollback journal, commit after every write)
+with current `db.database` (WAL, write-behind queue, batched commits).
+`python bench/bench_db.py` - run with default number of users and writes
+"""
+import os, sys, time, sqlite3, argparse, tempfile, threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from db import database
+
+def bench_commit_per_write(path: str, users: int, writes: int, threads: int) -> float:
+    """Old database: one shared connection, every set_value commits"""
+    connection = sqlite3.connect(path, check_same_thread=False)
+    cursor = connection.cursor()
+    lock = threading.Lock()
+    cursor.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, user_id INTEGER UNIQUE NOT NULL, last_schedule_request_time REAL DEFAULT 0)")
+    cursor.executemany("INSERT INTO users (user_id) VALUES (?)", [(uid,) for uid in range(users)])
+    connection.commit()
+
+    def worker(n: int):
+        for i in range(n, writes, threads):
+            with lock:
+                cursor.execute("UPDATE users SET last_schedule_request_time = ? WHERE user_id = ?", (time.time(), i % users))
+                connection.commit()
+
+    started = time.perf_counter()
+    run_threads(worker, threads)
+    elapsed = time.perf_counter() - started
+    connection.close()
+    return writes / elapsed
+
+def bench_write_behind(path: str, users: int, writes: int, threads: int) -> float:
+    """Current database, time includes final flush so every write is committed"""
+    db = database(path)
+    for uid in range(users):
+        db.add_user(uid, f"user{uid}")
+    db.flush()
+
+    def worker(n: int):
+        for i in range(n, writes, threads):
+            db.set_value(i % users, "last_schedule_request_time", time.time())
+
+    started = time.perf_counter()
+    run_threads(worker, threads)
+    db.flush()
+    elapsed = time.perf_counter() - started
+    db.close()
+    return writes / elapsed
+
+def run_threads(worker, threads: int) -> None:
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Database write benchmark")
+    parser.add_argument("--users", type=int, default=1000, help="number of users in table")
+    parser.add_argument("--writes", type=int, default=5000, help="number of set_value calls")
+    parser.add_argument("--threads", type=int, default=8, help="number of writing threads")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before = bench_commit_per_write(os.path.join(tmp, "old.db"), args.users, args.writes, args.threads)
+        after = bench_write_behind(os.path.join(tmp, "new.db"), args.users, args.writes, args.threads)
+
+    print(f"{'case':<36}{'writes/s':>12}")
+    print(f"{'commit per write':<36}{before:>12.0f}")
+    print(f"{'write-behind, WAL':<36}{after:>12.0f}")
+    print(f"speedup: x{after / before:.1f}")
+
+if __name__ == "__main__":
+    main()
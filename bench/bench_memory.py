@@ -0,0 +1,65 @@
+"""Schedule memory benchmark.
+
+Loads schedule of every group, lecturer and room from `bench/fixtures` (as crawler does)
+and measures memory held by them: lessons as plain dicts (old model) and as `lessons.Lesson` records.
+`python bench/bench_memory.py` - print memory of both models
+"""
+import os, sys, gc, argparse, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import kitis_api as api
+from bench import load_fixtures, setup_api
+
+def copy_str(value):
+    # parser returns new string objects for every lesson, copies are not shared like interned ones
+    return value.encode().decode() if isinstance(value, str) else value
+
+def as_dicts(data: dict) -> dict:
+    """Schedule with lessons as plain dicts with their own strings, as it was before lesson records"""
+    return {
+        "head":         data["head"],
+        "update_time":  data["update_time"],
+        "days":         {
+            date: {"weekday": info["weekday"], "lessons": [{key: copy_str(value) for key, value in lesson.items()} for lesson in info["lessons"]]}
+            for date, info in data["days"].items()
+        }
+    }
+
+def measure(build) -> tuple:
+    """Returns (bytes held by result of `build`, number of lessons)"""
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    count = sum(len(info["lessons"]) for data in result for info in data["days"].values())
+    return after - before, count
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Schedule memory benchmark")
+    parser.add_argument("--copies", type=int, default=1, help="load every source this many times (bigger dataset)")
+    args = parser.parse_args()
+
+    setup_api(load_fixtures())
+    sources = [(source_type, source) for source_type in ("group", "lecturer", "room") for source in api.links[f"s_{source_type}"]]
+    sources *= args.copies
+
+    # schedules are loaded outside of measurement, only what stays in memory is counted
+    loaded = [(source_type, api.load_schedule(source_type, source, api.links[f"s_{source_type}"][source])) for source_type, source in sources]
+    dict_size, count = measure(lambda: [as_dicts(data) for _, data in loaded])
+    loaded.clear()
+    compact_size, _ = measure(lambda: [api.load_schedule(source_type, source, api.links[f"s_{source_type}"][source]) for source_type, source in sources])
+
+    print(f"{len(sources)} schedules, {count} lessons")
+    print(f"{'model':<24}{'total, KB':>12}{'per lesson, B':>16}")
+    print(f"{'dict lessons':<24}{dict_size / 1024:>12.0f}{dict_size / count:>16.0f}")
+    print(f"{'lesson records':<24}{compact_size / 1024:>12.0f}{compact_size / count:>16.0f}")
+    print(f"saved: {(1 - compact_size / dict_size) * 100:.0f}%")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Startup time benchmark.
+
+Measures import time of bot modules in a fresh interpreter and time of `api.init_api()`
+with saved links.json, network is replaced with a slow fake site so it never blocks startup.
+`python bench/bench_startup.py` - run several times and print median
+"""
+import os, sys, ast, json, time, argparse, tempfile, subprocess, statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+def bot_modules() -> list:
+    """Modules of this repo bot.py imports at top level, so list never gets out of date"""
+    with open(os.path.join(ROOT, "bot.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    # their own imports (http_client, lessons, fast_parser...) are measured with them
+    return sorted({name for name in names if os.path.exists(os.path.join(ROOT, f"{name}.py"))})
+
+# modules bot.py imports before it can answer
+modules = bot_modules()
+# heavy modules that should not be imported on startup
+heavy = ["bs4", "fake_useragent", "flask"]
+
+import_script = f"""
+import sys, time, json
+sys.path.insert(0, {ROOT!r})
+started = time.perf_counter()
+import {", ".join(modules)}
+elapsed = time.perf_counter() - started
+print(json.dumps({{"time": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+init_script = f"""
+import sys, os, time, json
+sys.path.insert(0, {ROOT!r})
+import kitis_api as api
+
+# slow site, background refresh must not delay init
+def slow_request(link):
+    time.sleep(5)
+    return None
+api.try_request = slow_request
+
+started = time.perf_counter()
+api.init_api()
+elapsed = time.perf_counter() - started
+print(json.dumps({{"time": elapsed, "links": sum(len(v or {{}}) for v in api.links.values())}}))
+"""
+
+def run(script: str, cwd: str) -> dict:
+    out = subprocess.run([sys.executable, "-c", script], cwd=cwd, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def prepare(tmp: str) -> None:
+    """Config and links.json from fixtures in temporary directory"""
+    import kitis_api as api
+    base = "http://94.72.18.202:8083/"
+    api.config = {"links": {"base": base}}
+    with open(os.path.join(tmp, "config.json"), "w") as f:
+        json.dump({"links": {"base": base}}, f)
+    links = dict()
+    for key, filename in (("s_group", "cg.htm"), ("s_lecturer", "cp.htm"), ("s_room", "ca.htm")):
+        with open(os.path.join(ROOT, "bench", "fixtures", filename), "rb") as f:
+            links[key] = api.parse_links_page(f.read())
+    with open(os.path.join(tmp, "links.json"), "w") as f:
+        json.dump(links, f)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5, help="number of runs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare(tmp)
+        imports = [run(import_script, tmp) for _ in range(args.runs)]
+        inits = [run(init_script, tmp) for _ in range(args.runs)]
+
+    print(f"{'case':<36}{'median ms':>12}{'max ms':>12}")
+    for name, results in (("import modules", imports), ("init_api with links.json", inits)):
+        times = [r["time"] * 1000 for r in results]
+        print(f"{name:<36}{statistics.median(times):>12.1f}{max(times):>12.1f}")
+    print(f"heavy modules imported: {', '.join(imports[0]['heavy']) or 'none'}")
+    print(f"links loaded: {inits[0]['links']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Parser equivalence check.
+
+bs4 parser is kept as reference for the fast one: both must give exactly the same result
+on every saved page from `bench/fixtures`.
+`python bench/check_parsers.py` - compare both parsers, exits with 1 on mismatch
+"""
+import os, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bs4 import BeautifulSoup
+import kitis_api as api
+import fast_parser
+from bench import BASE, fixture_files, load_fixtures
+
+# first difference of two parse results, "" if they are equal
+def difference(reference, fast, path: str = "") -> str:
+    if type(reference) is not type(fast):
+        return f"{path or '/'}: {type(reference).__name__} != {type(fast).__name__}"
+    if isinstance(reference, dict):
+        for key in reference.keys() | fast.keys():
+            if key not in fast:
+                return f"{path}/{key}: missing in fast parser"
+            if key not in reference:
+                return f"{path}/{key}: missing in bs4 parser"
+            diff = difference(reference[key], fast[key], f"{path}/{key}")
+            if diff:
+                return diff
+        # order of days and links is shown to users
+        if list(reference) != list(fast):
+            return f"{path or '/'}: different order of keys"
+        return ""
+    if isinstance(reference, list):
+        if len(reference) != len(fast):
+            return f"{path or '/'}: {len(reference)} items != {len(fast)} items"
+        for i, (r, f) in enumerate(zip(reference, fast)):
+            diff = difference(r, f, f"{path}[{i}]")
+            if diff:
+                return diff
+        return ""
+    return "" if reference == fast else f"{path or '/'}: {reference!r} != {fast!r}"
+
+def main() -> None:
+    api.config = {"links": {"base": BASE}}
+    failed = 0
+    for key, content in load_fixtures().items():
+        soup = BeautifulSoup(content, "html.parser")
+        # links pages are "s_<type>", others are schedule pages
+        if key.startswith("s_"):
+            diff = difference(api.parse_soup_links(soup), fast_parser.parse_links(content, BASE))
+        else:
+            diff = difference(api.parse_soup_schedule(soup), fast_parser.parse_schedule(content, api.t_days))
+        print(f"{fixture_files[key]:<16}{'FAIL ' + diff if diff else 'ok'}")
+        failed += bool(diff)
+
+    if failed:
+        print(f"\n{failed} of {len(fixture_files)} pages are parsed differently")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
-import os, time, json
+import os, time, json, atexit, datetime
+# startup time is measured from here, including imports
+startup_started = time.perf_counter()
 import telebot as tb
-from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultArticle, InputTextMessageContent
 from typing import Union, Literal, cast
 
 # local files
@@ -9,6 +11,19 @@ from logger import log
 from db import database
 from exception_handler import BotExceptionHandler
 import kitis_api as api
+import messages
+import crawler
+import notifier
+import snapshots
+import broadcast
+import metrics
+import keyboards
+import callbacks
+import search
+import timetable
+import freerooms
+from dispatcher import PooledTeleBot
+from ratelimit import RateLimiter
 
 # load config
 # use default config file
@@ -16,7 +31,7 @@ if os.path.exists("config.json"):
     with open("config.json", 'r') as f:
         cfg = json.load(f)
     # init logger
-    logger.init_logger("log.log", "debug.log", cfg["colored_logs"], cfg["ntfy_topic"])
+    logger.init_logger("log.log", "debug.log", cfg["colored_logs"], cfg["ntfy_topic"], ntfy_digest_interval=cfg.get("ntfy_interval", 10))
     # choose mode
     bot_mode = cfg["mode"]
     if not bot_mode or (bot_mode != "polling" and bot_mode != "webhook"):
@@ -54,16 +69,94 @@ else:
             "r_group":      "http://94.72.18.202:8083/vg.htm",
             "r_lecturer":   "http://94.72.18.202:8083/vp.htm"
         },
+        # schedule cache (seconds)
+        # ttl - entry is fresh and served as is
+        # max_age - stale entry is still served while it refreshes in background
+        "cache": {
+            "ttl":          600,
+            "max_age":      3600
+        },
+        # http client for schedule site
+        # timeouts and backoff are in seconds, per_host limits concurrent requests to one host
+        "http": {
+            "pool_size":        10,
+            "per_host":         4,
+            "connect_timeout":  3.05,
+            "read_timeout":     10,
+            "retries":          3,
+            "backoff_base":     1,
+            "backoff_cap":      10
+        },
+        # site is considered down after `threshold` failed requests in a row,
+        # then cached schedules are served and site is checked every `probe_interval` seconds
+        "breaker": {
+            "threshold":        5,
+            "probe_interval":   15
+        },
+        # page parser: "fast" or "bs4" (original BeautifulSoup parser, slower)
+        "parser":           "fast",
+        # buttons on one page of group, lecturer and room selection keyboards
+        "keyboards": {
+            "page_size":    30
+        },
+        # background crawler keeps all schedules in cache
+        # interval - seconds between crawl rounds
+        # delay - politeness delay between page requests
+        "crawler": {
+            "enabled":      True,
+            "interval":     1800,
+            "delay":        1.0
+        },
+        # parsed schedules are saved to database and restored on startup (seconds)
+        # restore_max_age - older schedules are not restored, history_max_age - old versions are kept this long
+        "snapshots": {
+            "restore_max_age":  604800,
+            "history_max_age":  5184000,
+            # how often old versions are deleted
+            "prune_interval":   86400
+        },
+        # broadcasts (announcements and notifications)
+        # rate - messages per second for all chats, per_chat_interval - seconds between messages to one chat
+        "broadcast": {
+            "workers":              8,
+            "rate":                 25,
+            "per_chat_interval":    1
+        },
+        # spam protection, user gets one request every `interval` seconds and may do `burst` requests at once
+        # global budget is shared by all users, `rate` requests per second
+        # request times are written to database every `flush_interval` seconds
+        "rate_limits": {
+            "schedule":         {"interval": 3, "burst": 3},
+            "group":            {"interval": 3, "burst": 2},
+            "ping":             {"interval": 5, "burst": 2},
+            # inline queries come on every keystroke, limited only in memory
+            "inline":           {"interval": 1, "burst": 5},
+            "global":           {"rate": 30, "burst": 60},
+            "flush_interval":   60
+        },
+        # number of cached user rows
+        "user_cache_size":  10000,
+        # database writes are committed in batches, at least every `db_flush_interval` seconds
+        "db_flush_interval": 0.2,
+        # number of threads handling updates, updates of one chat are always handled in order
+        # max_backlog - updates waiting for handling, in webhook mode new updates are rejected when it is full
+        # (telegram delivers them again later), polling just waits
+        "max_backlog":      1000,
+        # secret token telegram sends with every webhook request, empty to disable check
+        "webhook_secret":   "",
+        "workers":          8,
         "admins":           [""],
         # topic example: "kitis_schedule_bot"
-        "ntfy_topic":       ""
+        "ntfy_topic":       "",
+        # ntfy.sh notifications that come within this many seconds are sent as one digest
+        "ntfy_interval":    10
     }
     with open("config.json", 'w', encoding="utf-8") as f:
         json.dump(conf_default, f, indent=4)
     cfg = conf_default
     bot_mode = "polling"
     # init logger
-    logger.init_logger("log.log", "debug.log", cfg["colored_logs"], cfg["ntfy_topic"])
+    logger.init_logger("log.log", "debug.log", cfg["colored_logs"], cfg["ntfy_topic"], ntfy_digest_interval=cfg.get("ntfy_interval", 10))
     log("warn", "Config.json not found! Created new config file and using it for now")
 
 # load token from private.py
@@ -76,7 +169,7 @@ except ImportError:
 try:
     exception_handler.set_token(TOKEN)
     handler = BotExceptionHandler()
-    bot = tb.TeleBot(TOKEN, exception_handler=handler, threaded=False)
+    bot = PooledTeleBot(TOKEN, workers=cfg.get("workers", 8), max_backlog=cfg.get("max_backlog", 1000), exception_handler=handler)
     # remove webhook if exists
     bot.remove_webhook()
 except Exception as e:
@@ -84,89 +177,168 @@ except Exception as e:
     exit(1)
 
 # Connecting to database
-db = database('db.db')
-
-# links_group contains links to group schedules
+db = database('db.db', cfg.get("user_cache_size", 10000), cfg.get("db_flush_interval", 0.2))
+
+# in-memory spam protection, request times are flushed to database periodically
+limits_cfg = cfg.get("rate_limits", {})
+limiter = RateLimiter(
+    {
+        command: (1 / limits_cfg.get(command, {}).get("interval", interval), limits_cfg.get(command, {}).get("burst", burst))
+        for command, interval, burst in (("schedule", 3, 3), ("group", 3, 2), ("ping", 5, 2), ("inline", 1, 5))
+    },
+    limits_cfg.get("global", {}).get("rate", 30),
+    limits_cfg.get("global", {}).get("burst", 60),
+    loader=lambda uid, command: db.get_value(uid, f"last_{command}_request_time"),
+    # inline users may not be in database at all
+    volatile=("inline",)
+)
+limiter.start_flusher(db, limits_cfg.get("flush_interval", 60))
+# atexit runs in reverse order: limiter queues its last writes first, then database commits everything queued
+# writer is a daemon thread, without this queued writes are lost on exit (webhook mode never calls db.close())
+atexit.register(db.close)
+atexit.register(limiter.stop, db)
+
+# queue depths for /stats and /metrics
+metrics.gauge("updates", bot.dispatcher.depth)
+metrics.gauge("db_writes", db.writes.qsize)
+metrics.gauge("log_records", lambda: logger.records.qsize() if logger.records else 0)
+
+# serve schedules saved before restart while they are refreshed
+snapshots_cfg = cfg.get("snapshots", {})
+snapshots.init_snapshots(db, snapshots_cfg.get("restore_max_age", 604800), snapshots_cfg.get("history_max_age", 5184000), snapshots_cfg.get("prune_interval", 86400))
+
+# every links and cache listener is registered before api is initialized and crawler is started,
+# so nothing loaded or fetched on startup is missed
+
+# ids of source names for callback data, they must exist before keyboards are built
+callbacks.init_callbacks(db)
+api.links_listeners.append(callbacks.register_names)
+
+# paginated keyboards for group, lecturer and room selection
+# built when links are loaded and rebuilt when they are refreshed
+keyboards_cfg = cfg.get("keyboards", {})
+keyboards.page_size = keyboards_cfg.get("page_size", 30)
+api.links_listeners.append(keyboards.build_keyboards)
+
+# inline mode search index, rebuilt with keyboards
+api.links_listeners.append(search.build_index)
+
+# per-date index of every parsed schedule for /today, /tomorrow and /week
+api.cache_listeners.append(timetable.on_cache)
+
+# occupancy index of rooms for /freerooms, filled from restored schedules and then by crawler
+freerooms.init_freerooms()
+api.cache_listeners.append(freerooms.on_cache)
+
+# links saved by previous run are used right away and refreshed in background
+# links are downloaded before start only if there are no saved ones
 log("trash", "Initializing api...")
 api.init_api()
 
-log("trash", "Getting links...")
-links_group     = api.get_source_links("s_group")
-links_lecturer  = api.get_source_links("s_lecturer")
-links_room      = api.get_source_links("s_room")
-
-if not links_group or not links_lecturer or not links_room:
+if not api.links.get("s_group") or not api.links.get("s_lecturer") or not api.links.get("s_room"):
     log("fail", "Can not get links, shutting down...")
     exit(2)
 
+# rate-limited broadcasts, continue ones interrupted by restart
+broadcast_cfg = cfg.get("broadcast", {})
+broadcast.init_broadcast(bot, db, broadcast_cfg.get("workers", 8), broadcast_cfg.get("rate", 25), broadcast_cfg.get("per_chat_interval", 1))
+broadcast.resume_broadcasts()
+
+# push schedule changes to subscribed users
+notifier.init_notifier(db)
+
+# keep every schedule warm, so handlers are served from cache
+crawler_cfg = cfg.get("crawler", {})
+if crawler_cfg.get("enabled", True):
+    crawler.start_crawler(crawler_cfg.get("interval", 1800), crawler_cfg.get("delay", 1.0))
+
 # generate schedule message based on api info
 def gen_message_schedule(source_type: Literal["group", "lecturer", "room"], source: str) -> str:
     data = api.get_schedule(source_type, source)
     if not data:
         return ""
-    # generate message
-    if source_type == "group":      msg = f"""Расписание группы <b>{data["head"]}</b>\n"""
-    elif source_type == "lecturer": msg = f"""Расписание преподавателя <b>{data["head"]}</b>\n"""
-    elif source_type == "room":     msg = f"""Расписание аудитории <b>{data["head"]}</b>\n"""
-
-    for date, info in data["days"].items():
-        if not info["lessons"] and (info["weekday"] == "Суббота" or info["weekday"] == "Воскресенье"): continue
-
-        msg += f"""\n--------------------------\n\n{date} - <b>{info["weekday"]}</b>\n\n"""
-        if source_type == "group":
-            for lesson in info["lessons"]:
-                msg += f"""<u>{lesson["number"]} Пара</u> - <i>{lesson["bells"]}</i> - {lesson["name"]} {f"({lesson['subgroup']}) " if lesson["subgroup"] != "0" and not "Иностранный язык" in lesson["name"] else ""}- <i>{lesson["room"]}</i>\n"""
-        elif source_type == "lecturer":
-            for lesson in info["lessons"]:
-                msg += f"""<u>{lesson["number"]} Пара</u> - <i>{lesson["bells"]}</i> - <b>{lesson["group"]}</b> - {lesson["name"]} - <i>{lesson["room"]}</i>\n"""
-        elif source_type == "room":
-            for lesson in info["lessons"]:
-                msg += f"""<u>{lesson["number"]} Пара</u> - <i>{lesson["bells"]}</i> - {lesson["lecturer"]} - <b>{lesson["group"]}</b> - {lesson["name"]}\n"""
-
-    msg += f"""\n--------------------------\n<i>{data["update_time"]}</i>"""
-    return msg
+    return messages.render_schedule(source_type, data) + stale_note(source_type, source)
+
+# old cached schedule is shown, say how old it is
+# "site is down" only when it really is, restored schedules are served at any age while refreshing
+def stale_note(source_type: Literal["group", "lecturer", "room"], source: str) -> str:
+    age = api.schedule_age(source_type, source)
+    if age is None or age < api.cache_ttl:
+        return ""
+    down = api.host_down()
+    if down or age >= api.cache_max_age:
+        return messages.format_stale_note(age, down)
+    return ""
+
+# generate inline mode message: current week (whole schedule if week is not published), always fits one message
+# one result longer than telegram limit makes it reject the whole answer
+def gen_message_inline(source_type: Literal["group", "lecturer", "room"], source: str, data: dict) -> str:
+    index = timetable.get_index(source_type, source, data)
+    day = datetime.date.today()
+    days = timetable.week_days(index, day)
+    if days:
+        first = day - datetime.timedelta(days=day.weekday())
+        msg = messages.render_days(source_type, data, "week", first.strftime("%d.%m.%Y"), days, "")
+    else:
+        msg = messages.render_schedule(source_type, data)
+    return messages.fit_message(msg)
+
+# generate message with part of schedule: today, tomorrow or current week
+def gen_message_days(source_type: Literal["group", "lecturer", "room"], source: str, kind: Literal["today", "tomorrow", "week"]) -> str:
+    data = api.get_schedule(source_type, source)
+    if not data:
+        return ""
+    index = timetable.get_index(source_type, source, data)
+    now = datetime.datetime.now()
+    day = now.date() + datetime.timedelta(days=1 if kind == "tomorrow" else 0)
+
+    if kind == "week":
+        days = timetable.week_days(index, day)
+        first = day - datetime.timedelta(days=day.weekday())
+    else:
+        days = [index[day]] if day in index else []
+        first = day
+    # dates inside published period have a day in index even if there are no lessons
+    empty = "Занятий нет" if index and min(index) <= day <= max(index) else "Расписание на эту дату ещё не опубликовано"
+    msg = messages.render_days(source_type, data, kind, first.strftime("%d.%m.%Y"), days, empty)
+
+    if kind == "today":
+        lesson = timetable.next_lesson(index, now)
+        if lesson:
+            msg += messages.format_next_lesson(source_type, lesson, now.strftime("%d.%m.%Y"))
+    return msg + stale_note(source_type, source)
 
 # generate markup for schedule source
 def gm_schedule_sourcetype():
     markup = InlineKeyboardMarkup()
     markup.row_width = 3
     markup.add(
-        InlineKeyboardButton("Группы", callback_data="group"),
-        InlineKeyboardButton("Преподаватели", callback_data="lecturer"),
-        InlineKeyboardButton("Аудитории", callback_data="room")
+        InlineKeyboardButton("Группы", callback_data=callbacks.encode("t", "group")),
+        InlineKeyboardButton("Преподаватели", callback_data=callbacks.encode("t", "lecturer")),
+        InlineKeyboardButton("Аудитории", callback_data=callbacks.encode("t", "room"))
     )
     return markup
 kb_source_schedule = gm_schedule_sourcetype()
 
-# generate markup keyboard for group selection
-def gm_schedule_source(source_type: Literal["group", "lecturer", "room"]):
-    markup = InlineKeyboardMarkup()
-    markup.row_width = 3
-    keys = []
-    if source_type == "group":      keys = list(links_group.keys())
-    if source_type == "lecturer":   keys = list(links_lecturer.keys())
-    if source_type == "room":       keys = list(links_room.keys())
-    IKB_list = list()
-
-    for n in range(len(keys)):
-        IKB_list.append(InlineKeyboardButton(keys[n], callback_data=keys[n]))
-
-    markup.add(*IKB_list)
-    return markup
-kb_schedule = gm_schedule_source("group")
-
 def is_spam_or_ungroupped(uid: int, check_type: Literal["schedule", "group", "ping"]):
-    cooldown = 3
     # check group if needed
     if check_type != "group" and not db.get_value(uid, "user_group"):
         log("warn", f"{uid} did not set a group!")
         bot.send_message(uid, "Сначала выберите группу! - /group")
         return True
-    # check spam
-    elif time.time() - db.get_value(uid, f"last_{check_type}_request_time") < cooldown:
+    return is_spam(uid, check_type)
+
+# only rate limit, for commands that do not need user group
+def is_spam(uid: int, check_type: Literal["schedule", "group", "ping"]):
+    limited = limiter.check(uid, check_type)
+    if limited == "user":
         log("warn", f"{uid} is too fast!")
         bot.send_message(uid, "Вы слишком часто делаете запросы! Подождите немного и попробуйте снова...")
         return True
+    elif limited == "global":
+        log("warn", f"Global rate limit reached, rejected {uid}")
+        bot.send_message(uid, "Бот сейчас перегружен запросами! Попробуйте снова через несколько секунд...")
+        return True
     return False
 
 # check user
@@ -198,7 +370,6 @@ def send_schedule(uid: int, source_type: Literal["group", "lecturer", "room"], s
     if text:
         log("ok", f"Sent schedule - {uid}")
         bot.edit_message_text(text, uid, message_id=mes.id, parse_mode="HTML")
-        db.set_value(uid, "last_schedule_request_time", time.time())
     else:
         log("fail", f"Did not sent schedule - {uid}")
         bot.edit_message_text("Не удалось получить расписание! Попробуйте позже...", uid, mes.id, parse_mode="HTML")
@@ -216,6 +387,81 @@ def bot_schedule(message) -> None:
     send_schedule(uid, "group", db.get_value(uid, "user_group"))
     return
 
+# Today, tomorrow and week commands, same as /schedule but only part of it
+@bot.message_handler(commands=["today", "tomorrow", "week"])
+def bot_schedule_days(message) -> None:
+    uid = message.chat.id
+    uname = message.chat.username
+    checkUser(uid, uname)
+    kind = message.text.split()[0].lstrip("/").split("@")[0].lower()
+    log("info", f"/{kind} - {uid} ({uname})")
+    if is_spam_or_ungroupped(uid, check_type="schedule"):
+        return
+
+    text = gen_message_days("group", db.get_value(uid, "user_group"), kind)
+    if text:
+        log("ok", f"Sent {kind} schedule - {uid}")
+        bot.send_message(uid, text, parse_mode="HTML")
+    else:
+        log("fail", f"Did not sent {kind} schedule - {uid}")
+        bot.send_message(uid, "Не удалось получить расписание! Попробуйте позже...", parse_mode="HTML")
+    return
+
+# Free rooms command, /freerooms [date] [lesson], answered from occupancy index only
+@bot.message_handler(commands=["freerooms"])
+def bot_freerooms(message) -> None:
+    uid = message.chat.id
+    uname = message.chat.username
+    checkUser(uid, uname)
+    log("info", f"/freerooms - {uid} ({uname})")
+    # staff usually have no group
+    if is_spam(uid, check_type="schedule"):
+        return
+
+    args = freerooms.parse_args(message.text.split()[1:], datetime.date.today())
+    if args is None:
+        bot.send_message(uid, "Использование: /freerooms [дата] [пара]\nНапример: <code>/freerooms 13.10 2</code>", parse_mode="HTML")
+        return
+    day, number = args
+    date = day.strftime("%d.%m.%Y")
+    weekday = list(api.t_days.values())[day.weekday()]
+    bells = api.t_bells_monday if weekday == "Понедельник" else api.t_bells_week
+
+    free = [(n, bells[n], freerooms.free_rooms(date, n)) for n in ([number] if number else freerooms.numbers)]
+    if free[0][2] is None:
+        bot.send_message(uid, "Расписание аудиторий на эту дату ещё не загружено! Попробуйте позже или выберите другую дату...")
+        return
+    bot.send_message(uid, messages.format_free_rooms(date, weekday, free, *freerooms.coverage()), parse_mode="HTML")
+    log("ok", f"Sent free rooms for {date} {number or 'all'} - {uid}")
+    return
+
+# saved versions of group schedule, /history - list of versions, /history <n> - version n
+@bot.message_handler(commands=["history"])
+def bot_history(message) -> None:
+    uid = message.chat.id
+    uname = message.chat.username
+    checkUser(uid, uname)
+    log("info", f"/history - {uid} ({uname})")
+    if is_spam_or_ungroupped(uid, check_type="schedule"):
+        return
+
+    group = db.get_value(uid, "user_group")
+    versions = snapshots.history("group", group)
+    args = message.text.split()[1:]
+    if not args:
+        bot.send_message(uid, messages.format_history(group, versions[:10]), parse_mode="HTML")
+        return
+    if not args[0].isdigit() or not 1 <= int(args[0]) <= len(versions):
+        bot.send_message(uid, "Такой версии нет! Список версий - /history")
+        return
+    data = snapshots.schedule_at("group", group, versions[int(args[0]) - 1][1])
+    if not data:
+        bot.send_message(uid, "Такой версии нет! Список версий - /history")
+        return
+    bot.send_message(uid, messages.fit_message(messages.format_schedule("group", data)), parse_mode="HTML")
+    log("ok", f"Sent schedule version {args[0]} - {uid}")
+    return
+
 # get schedule by source type - group, lecturer or room
 @bot.message_handler(commands=["scheduleby"])
 def bot_scheduleby(message) -> None:
@@ -236,66 +482,127 @@ def bot_group(message) -> None:
     checkUser(message.chat.id, message.chat.username)
 
     log("info", f"/group - {message.chat.id} ({message.chat.username}, {db.get_value(message.chat.id, 'id')})")
-    bot.send_message(message.chat.id, 'Выберите свою группу:', reply_markup=kb_schedule)
+    bot.send_message(message.chat.id, 'Выберите свою группу:', reply_markup=keyboards.page("G"))
     return
 
 # Callback query handler (buttons in bot messages)
+# callback data is "<prefix><action>:<argument>" (see callbacks.py), handlers are registered below
 @bot.callback_query_handler(func=lambda call: True)
 def callback_query(call) -> None:
+    if not callbacks.dispatch(call):
+        # buttons of messages sent before callback data format was changed
+        log("warn", f"Unknown callback query data from {call.from_user.id}: {call.data}")
+        bot.answer_callback_query(call.id, "Эта кнопка устарела, повторите команду")
+    return
+
+# /scheduleby source type selected, same message is reused for source selection
+@callbacks.handler("t")
+def cb_source_type(call, argument: str) -> None:
+    prompts = {
+        "group":    "Выберите группу:",
+        "lecturer": "Выберите преподавателя:",
+        "room":     "Выберите аудиторию:"
+    }
+    if argument in prompts:
+        bot.edit_message_text(prompts[argument], call.message.chat.id, call.message.id, reply_markup=keyboards.show_page(cast(Literal["group", "lecturer", "room"], argument)))
+    bot.answer_callback_query(call.id)
+
+# keyboard paging, pages are already built so only markup of this message is replaced
+def show_markup(call, markup) -> None:
+    if markup:
+        try:
+            bot.edit_message_reply_markup(call.message.chat.id, call.message.id, reply_markup=markup)
+        # same page clicked again
+        except tb.apihelper.ApiTelegramException as e:
+            if "message is not modified" not in e.description:
+                raise
+    bot.answer_callback_query(call.id)
+
+@callbacks.handler("p")
+def cb_page(call, argument: str) -> None:
+    show_markup(call, keyboards.page_markup(argument))
+
+@callbacks.handler("i")
+def cb_index(call, argument: str) -> None:
+    show_markup(call, keyboards.index_markup(argument))
+
+# schedule of selected source
+@callbacks.handler("s")
+def cb_show_schedule(call, argument: str) -> None:
     uid = call.message.chat.id
-    uname = call.message.chat.username
-    cd = call.data
-    # ctext = call.message.text
-    dbid = db.get_value(uid, "id")
+    source = callbacks.name_by_id(argument)
+    if source is None:
+        log("fail", f"Unknown source id from {uid}: {argument}")
+        bot.answer_callback_query(call.id, "Не могу выполнить запрос!")
+        return
+    bot.answer_callback_query(call.id)
+    bot.delete_message(uid, call.message.id)
+    send_schedule(uid, cast(Literal["group", "lecturer", "room"], source[0]), source[1])
 
-    cq_action = ""
-    if   "Выберите свою группу:" in call.message.text:          cq_action = "group_pickup"
-    elif "Выберите источник расписания:" in call.message.text:  cq_action = "scheduleby_typeSelect"
-    elif "Выберите группу:" in call.message.text:               cq_action = "scheduleby_group"
-    elif "Выберите преподавателя:" in call.message.text:        cq_action = "scheduleby_lecturer"
-    elif "Выберите аудиторию:" in call.message.text:            cq_action = "scheduleby_room"
-
-    # scheduleby source type selected
-    if cq_action == "scheduleby_typeSelect":
-        bot.delete_message(uid, call.message.id)
-        if cd == "group":
-            bot.send_message(uid, "Выберите группу:", reply_markup=gm_schedule_source("group"))
-        elif cd == "lecturer":
-            bot.send_message(uid, "Выберите преподавателя:", reply_markup=gm_schedule_source("lecturer"))
-        elif cd == "room":
-            bot.send_message(uid, "Выберите аудиторию:", reply_markup=gm_schedule_source("room"))
+# Group pickup request
+@callbacks.handler("g")
+def cb_group_pickup(call, argument: str) -> None:
+    uid = call.message.chat.id
+    uname = call.message.chat.username
+    source = callbacks.name_by_id(argument)
+    if source is None or source[0] != "group":
+        log("fail", f"Unknown group id from {uid}: {argument}")
+        bot.answer_callback_query(call.id, "Не могу выполнить запрос!")
+        return
+    # check if using commands too fast (spamming)
+    if is_spam_or_ungroupped(uid, check_type="group"):
+        bot.answer_callback_query(call.id)
         return
-    # get schedule by group
-    elif "scheduleby" in cq_action:
-        bot.delete_message(uid, call.message.id)
-        source_type = cast(Literal["group", "lecturer", "room"], cq_action.split("_")[1])
-        send_schedule(uid, source_type, cd)
-
-    # Group pickup request
-    elif cq_action == "group_pickup":
-        # check if using commands too fast (spamming)
-        if is_spam_or_ungroupped(uid, check_type="group"):
-            bot.answer_callback_query(call.id)
-            return
-        db.set_value(uid, 'last_group_request_time', time.time())
-        db.set_value(uid, 'user_group', cd)
-        bot.send_message(uid, f'Вы выбрали группу {db.get_value(uid, "user_group")}!')
-        # check if user has group
-        if db.user_has_group(uid):
-            log("ok", f"Set {db.get_value(uid, 'user_group')} group for {uid} ({uname}, {dbid})")
-        # why the fuck it did not set a group :sob:
-        else:
-            log("fail", f"What the actual fuck happened (group for {uid} is not set after trying to set it) ({uname}, {dbid})")
-
-    # Callback query is empty wtf
-    elif cq_action == '':
-        bot.send_message(uid, 'Не могу выполнить запрос!')
-        log("fail", f"Empty callback query action from {uid} ({uname}, {dbid})")
-    # Unknown callback query action (you are cooked up)
+    dbid = db.get_value(uid, "id")
+    db.set_value(uid, 'user_group', source[1])
+    bot.send_message(uid, f'Вы выбрали группу {db.get_value(uid, "user_group")}!')
+    # check if user has group
+    if db.user_has_group(uid):
+        log("ok", f"Set {db.get_value(uid, 'user_group')} group for {uid} ({uname}, {dbid})")
+    # why the fuck it did not set a group :sob:
     else:
-        log("fail", f"Unknown callback query action from {uid} ({uname}, {dbid})")
+        log("fail", f"What the actual fuck happened (group for {uid} is not set after trying to set it) ({uname}, {dbid})")
     # Closing callback query (Unfreezing buttons)
     bot.answer_callback_query(call.id)
+
+# inline mode: "@bot name" in any chat, answered only from cached schedules
+@bot.inline_handler(func=lambda query: True)
+def inline_schedule(query) -> None:
+    uid = query.from_user.id
+    if limiter.check(uid, "inline"):
+        log("warn", f"{uid} is too fast in inline mode!")
+        bot.answer_inline_query(query.id, [], cache_time=1, is_personal=True)
+        return
+
+    results = []
+    for source_type, source in search.find(query.query, 10):
+        data = api.peek_schedule(source_type, source)
+        # not cached yet, crawler will bring it
+        if not data:
+            continue
+        results.append(InlineQueryResultArticle(
+            id=f"{source_type}:{len(results)}",
+            title=source,
+            description=f"{messages.titles[source_type]}, {data['update_time']}",
+            input_message_content=InputTextMessageContent(gen_message_inline(source_type, source, data), parse_mode="HTML")
+        ))
+    bot.answer_inline_query(query.id, results, cache_time=60)
+    log("trash", f"inline \"{query.query}\" - {query.from_user.id}: {len(results)} results")
+
+# schedule change notifications on/off
+@bot.message_handler(commands=["notify"])
+def bot_notify(message) -> None:
+    uid = message.chat.id
+    uname = message.chat.username
+    checkUser(uid, uname)
+    log("info", f"/notify - {uid} ({uname})")
+
+    notify = 0 if db.get_value(uid, "notify") else 1
+    db.set_value(uid, "notify", notify)
+    if notify:
+        bot.send_message(uid, "Уведомления об изменениях в расписании вашей группы <b>включены</b>", parse_mode="HTML")
+    else:
+        bot.send_message(uid, "Уведомления об изменениях в расписании вашей группы <b>выключены</b>", parse_mode="HTML")
     return
 
 # ping command
@@ -310,11 +617,14 @@ def bot_ping(message):
     if is_spam_or_ungroupped(uid, check_type="ping"):
         return
 
-    mes = bot.send_message(uid, "<u>Текущее состояние сайта</u>: <b>ожидание...</b>\n<u>Код статуса</u>: <b>ожидание...</b>\n<u>Время отклика</u>: <b>ожидание...</b>", parse_mode="HTML")
-    db.set_value(uid, 'last_ping_request_time', time.time())
-
-    response = api.ping(link=cfg["links"]["index"])
-    bot.edit_message_text(f"""<u>Текущее состояние сайта</u>: <b>{response["status"]}</b>\n<u>Код статуса</u>: <b>{response["code"]}</b>\n<u>Время отклика</u>: <b>{response["time"]} сек.</b>""", uid, mes.id, parse_mode="HTML")
+    # state is taken from circuit breaker and the last request, no new request is made
+    response = api.health(link=cfg["links"]["index"])
+    text = f"""<u>Текущее состояние сайта</u>: <b>{response["status"]}</b>\n<u>Код статуса</u>: <b>{response["code"]}</b>\n<u>Время отклика</u>: <b>{response["time"]} сек.</b>"""
+    if "down_for" in response:
+        text += f"""\n<u>Недоступен</u>: <b>{messages.format_age(response["down_for"])}</b>, бот показывает сохранённое расписание"""
+    if response["checked"] is not None:
+        text += f"""\n<u>Проверено</u>: <b>{round(response["checked"])} сек. назад</b>"""
+    bot.send_message(uid, text, parse_mode="HTML")
     log("ok", f"/ping code: {response['code']} - {uid}")
     return
 
@@ -385,21 +695,17 @@ def announcement(message, file_id = ''):
     # log   :exploding_head:
     log("trash", f"Sending an announcement to:\n{str(ann_ids)}")
 
-    # send to all receivers
+    # skip garbage lines, IDs must be numbers
+    valid_ids = list()
     for id in ann_ids:
-        try:
-            # check if message has image
-            if (file_id != ''):
-                # message has image - send it too
-                bot.send_photo(id, file_id, ann_mes, parse_mode='HTML')
-            else:
-                bot.send_message(id, ann_mes, parse_mode='HTML', disable_web_page_preview=True)
-        except:
-            # failed to send to some user ( chat not found most likely )
-            log("warn", f"Failed to send announcement to {id}")
+        if id.strip().lstrip('-').isdigit():
+            valid_ids.append(int(id))
+        elif id.strip():
+            log("warn", f"Invalid announcement receiver ID: {id}")
 
-    # distribution complete
-    log("ok", f"Sent announcement:\n{ann_mes}")
+    # send to all receivers in background, progress is reported to admin
+    bid = broadcast.start_broadcast(ann_mes, file_id, message.chat.id, valid_ids)
+    log("ok", f"Started announcement #{bid}:\n{ann_mes}")
 
 # handle messages with photos
 @bot.message_handler(content_types=['photo'])
@@ -408,6 +714,73 @@ def photo_handler(message):
     if message.caption and f'/{command_announ}' in message.caption:
         announcement(message, message.photo[-1].file_id)
 
+# crawler progress
+@bot.message_handler(commands=["crawl"])
+def debug_bot_crawl(message) -> None:
+    uid = message.chat.id
+
+    if str(uid) not in cfg["admins"]:
+        return
+    st = crawler.status()
+    now = time.time()
+    text = f"""<u>Краулер</u>: <b>{"работает" if st["running"] else "остановлен"}</b>
+<u>Проход</u>: <b>{st["round"]}</b>
+<u>Прогресс</u>: <b>{st["done"] + st["failed"]}/{st["total"]}</b> (ошибок: {st["failed"]})
+<u>Текущая страница</u>: <b>{st["current"] or "---"}</b>
+<u>Прошлый проход</u>: <b>{f"{round(st['duration'])} сек." if st["finished"] else "---"}</b>
+<u>В кэше</u>: <b>{st["cached"]}</b>, самое старое: <b>{f"{round(now - st['oldest'])} сек. назад" if st["oldest"] else "---"}</b>"""
+    bot.send_message(uid, text, parse_mode="HTML")
+    return
+
+# recent upstream request timings
+@bot.message_handler(commands=["upstream"])
+def debug_bot_upstream(message) -> None:
+    uid = message.chat.id
+
+    if str(uid) not in cfg["admins"]:
+        return
+    st = api.client.stats()
+    codes = ", ".join(f"{code}: {count}" for code, count in st["codes"].items()) or "---"
+    last = f"{st['last'][2]}, {st['last'][3]:.3f} сек., {round(time.time() - st['last'][0])} сек. назад" if st["last"] else "---"
+    text = f"""<u>Запросов к сайту</u>: <b>{st["count"]}</b> (ошибок: {st["errors"]})
+<u>Время ответа</u>: p50 <b>{st["p50"]:.3f}</b>, p95 <b>{st["p95"]:.3f}</b>, max <b>{st["max"]:.3f}</b> сек.
+<u>Коды</u>: {codes}
+<u>Последний запрос</u>: {last}"""
+    bot.send_message(uid, text, parse_mode="HTML")
+    return
+
+# latency histograms, counters and queue depths
+@bot.message_handler(commands=["stats"])
+def debug_bot_stats(message) -> None:
+    uid = message.chat.id
+
+    if str(uid) not in cfg["admins"]:
+        return
+    lines = [f"<u>Работает</u>: <b>{round((time.time() - metrics.started) / 60)} мин.</b>", "", "<u>Время (p50 / p95, сек.)</u>:"]
+    for (stage, label), (count, p50, p95, _) in sorted(metrics.summary().items()):
+        lines.append(f"{stage}{f' {label}' if label else ''}: <b>{p50:g} / {p95:g}</b> ({count})")
+
+    lines.append("")
+    lines.append("<u>Ответы сайта</u>:")
+    statuses = metrics.counter_values("upstream_status")
+    # requests refused by circuit breaker never reached the site, they are not connection errors
+    refused = statuses.pop("breaker_open", 0)
+    for code, count in sorted(statuses.items()):
+        name = api.statuses.get(int(code), "") if code.isdigit() else "ошибка соединения"
+        lines.append(f"{code} ({name}): <b>{count}</b>")
+    lines.append(f"Повторов: <b>{metrics.counter_values('upstream_retry').get('', 0)}</b>")
+    lines.append(f"Не отправлено (сайт недоступен): <b>{refused}</b>")
+
+    lines.append("")
+    lines.append("<u>Попадания в кэш</u>:")
+    for name in ("schedule_cache", "render_cache", "user_cache"):
+        lines.append(f"{name}: <b>{metrics.hit_rate(name) * 100:.1f}%</b>")
+
+    lines.append("")
+    lines.append("<u>Очереди</u>: " + ", ".join(f"{name} <b>{value}</b>" for name, value in sorted(metrics.read_gauges().items())))
+    bot.send_message(uid, "\n".join(lines), parse_mode="HTML")
+    return
+
 @bot.message_handler(commands=["test"])
 def debug_bot_test(message) -> None:
     uid = message.chat.id
@@ -421,18 +794,31 @@ def debug_bot_test(message) -> None:
     l[1] -= 1
     return
 
+startup_time = time.perf_counter() - startup_started
+log("ok", f"Bot initialized in {startup_time:.2f} s")
+
 # initialize flask and webhook if using webhook mode
+# flask is imported only here, polling does not need it
 if bot_mode == "webhook":
     from flask import Flask, request
     app = Flask(__name__)
 
+    # update is only validated and queued here, handlers run in dispatcher workers
+    # so telegram gets its answer right away and does not deliver the same update again
     @app.route("/kitisbot_webhook", methods=["POST"])
     def handle_webhook():
         try:
+            if cfg.get("webhook_secret") and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != cfg["webhook_secret"]:
+                log("warn", "Webhook: wrong secret token")
+                return "Forbidden", 403
             if request.stream:
                 update = tb.types.Update.de_json(request.stream.read().decode("utf-8"))
                 if update is not None:
-                    bot.process_new_updates([update])
+                    result = bot.dispatcher.submit(update, block=False)
+                    # backlog is full, telegram will deliver this update again later
+                    if result == "full":
+                        log("warn", f"Webhook: backlog is full, rejected update {update.update_id}")
+                        return "Overloaded", 503, {"Retry-After": "5"}
                     return "OK", 200
                 else:
                     return "No data", 400
@@ -443,11 +829,16 @@ if bot_mode == "webhook":
             log("fail", f"Webhook: error - {e}. Skipping...")
             return "Error", 202 # it should be 500, but otherwise errors will be continious in certain circumstances
 
+    # metrics in prometheus text format
+    @app.route("/metrics", methods=["GET"])
+    def handle_metrics():
+        return metrics.render_prometheus(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
     def set_webhook():
         try:
             bot.remove_webhook()
             webhook_url = cfg["links"]["webhook"]
-            bot.set_webhook(url=webhook_url)
+            bot.set_webhook(url=webhook_url, secret_token=cfg.get("webhook_secret") or None)
             log("trash", f"Set webhook: '{webhook_url}'")
         except Exception as e:
             log("fail", f"Failed to set webhook: {e}")
@@ -475,6 +866,10 @@ elif bot_mode == "polling" and __name__ == "__main__":
         try:
             time.sleep(2)
         except (KeyboardInterrupt):
+            crawler.stop_crawler()
+            bot.dispatcher.stop()
+            api.client.close()
+            limiter.stop(db)
             db.close()
             print()
             log("trash", "Bot stopped")
@@ -0,0 +1,141 @@
+import time, queue, threading
+from typing import Optional
+import telebot as tb
+from logger import log
+from ratelimit import TokenBucket
+
+# rate-limited parallel broadcasts (announcements and notifications)
+# every broadcast and its receivers are stored in database, so unfinished ones resume after restart
+
+bot = None
+db = None
+workers: int = 8
+# telegram allows about 30 messages per second globally and 1 per second per chat
+global_bucket = TokenBucket(25, 25)
+per_chat_interval: float = 1.0
+# chat id -> time of last message
+last_sent = dict()
+last_sent_lock = threading.Lock()
+# telegram asked to wait (429), nobody sends until this time
+paused_until: float = 0.0
+# how often admin progress message is updated
+progress_interval: float = 5.0
+
+# errors that mean user will never get messages (blocked bot, deleted account, chat not found)
+def is_unreachable(e: tb.apihelper.ApiTelegramException) -> bool:
+    return e.error_code == 403 or (e.error_code == 400 and "chat not found" in e.description.lower())
+
+def retry_after(e: tb.apihelper.ApiTelegramException) -> float:
+    return float(e.result_json.get("parameters", {}).get("retry_after", 1))
+
+def wait_turn(uid: int) -> None:
+    """Blocks until message to `uid` fits all limits"""
+    # telegram pause after 429
+    while (delay := paused_until - time.time()) > 0:
+        time.sleep(delay)
+    # per-chat limit
+    with last_sent_lock:
+        delay = last_sent.get(uid, 0) + per_chat_interval - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    global_bucket.acquire()
+    with last_sent_lock:
+        last_sent[uid] = time.time()
+
+def send(uid: int, text: str, file_id: str) -> None:
+    if file_id:
+        bot.send_photo(uid, file_id, text, parse_mode="HTML")
+    else:
+        bot.send_message(uid, text, parse_mode="HTML", disable_web_page_preview=True)
+
+def run_broadcast(bid: int, text: str, file_id: str, admin_id: Optional[int], user_ids: list) -> None:
+    total = len(user_ids)
+    counts = {"sent": 0, "unreachable": 0, "failed": 0}
+    counts_lock = threading.Lock()
+    q = queue.Queue()
+    for uid in user_ids:
+        q.put((uid, 0))
+
+    def worker():
+        global paused_until
+        while True:
+            try:
+                uid, attempts = q.get_nowait()
+            except queue.Empty:
+                return
+            wait_turn(uid)
+            status, error = "sent", ""
+            try:
+                send(uid, text, file_id)
+            except tb.apihelper.ApiTelegramException as e:
+                if e.error_code == 429 and attempts < 5:
+                    delay = retry_after(e)
+                    paused_until = max(paused_until, time.time() + delay)
+                    log("warn", f"Broadcast #{bid}: too many requests, pausing for {delay} s")
+                    q.put((uid, attempts + 1))
+                    continue
+                status = "unreachable" if is_unreachable(e) else "failed"
+                error = e.description
+            except Exception as e:
+                status, error = "failed", f"{type(e).__name__}: {e}"
+            db.set_broadcast_target(bid, uid, status, error)
+            with counts_lock:
+                counts[status] += 1
+
+    progress_msg = None
+    if admin_id:
+        try:
+            progress_msg = bot.send_message(admin_id, f"Рассылка #{bid}: 0/{total}")
+        except Exception as e:
+            log("warn", f"Broadcast #{bid}: can not send progress to admin: {e}")
+
+    threads = [threading.Thread(target=worker, name=f"broadcast-{bid}-{n}", daemon=True) for n in range(min(workers, max(1, total)))]
+    for t in threads:
+        t.start()
+    last_progress = time.time()
+    while any(t.is_alive() for t in threads):
+        time.sleep(0.5)
+        if progress_msg and time.time() - last_progress >= progress_interval:
+            last_progress = time.time()
+            with counts_lock:
+                done = sum(counts.values())
+            try:
+                bot.edit_message_text(f"Рассылка #{bid}: {done}/{total}", admin_id, progress_msg.id)
+            except Exception:
+                pass
+
+    db.finish_broadcast(bid)
+    log("ok", f"Broadcast #{bid} finished: sent {counts['sent']}, unreachable {counts['unreachable']}, failed {counts['failed']}")
+    if counts["unreachable"] or counts["failed"]:
+        log("trash", f"Broadcast #{bid} not delivered to: {db.get_broadcast_failed(bid)}")
+    if progress_msg:
+        try:
+            summary = f"Рассылка #{bid} завершена: отправлено {counts['sent']}, недоступно {counts['unreachable']}, ошибок {counts['failed']}"
+            bot.edit_message_text(summary, admin_id, progress_msg.id)
+        except Exception:
+            pass
+
+def start_broadcast(text: str, file_id: str, admin_id: Optional[int], user_ids: list) -> int:
+    """Save broadcast and send it in background. Returns broadcast id"""
+    # remove duplicates, keep order
+    user_ids = list(dict.fromkeys(int(uid) for uid in user_ids))
+    bid = db.add_broadcast(text, file_id, admin_id, user_ids)
+    log("trash", f"Broadcast #{bid}: {len(user_ids)} receivers")
+    threading.Thread(target=run_broadcast, args=(bid, text, file_id, admin_id, user_ids), name=f"broadcast-{bid}", daemon=True).start()
+    return bid
+
+def resume_broadcasts() -> None:
+    """Continue broadcasts interrupted by restart"""
+    for bid, text, file_id, admin_id in db.get_unfinished_broadcasts():
+        user_ids = db.get_broadcast_pending(bid)
+        log("info", f"Broadcast #{bid}: resuming, {len(user_ids)} receivers left")
+        threading.Thread(target=run_broadcast, args=(bid, text, file_id, admin_id, user_ids), name=f"broadcast-{bid}", daemon=True).start()
+
+def init_broadcast(telebot, database, broadcast_workers: int = workers, rate: float = 25, chat_interval: float = per_chat_interval) -> None:
+    global bot, db, workers, global_bucket, per_chat_interval
+
+    bot = telebot
+    db = database
+    workers = broadcast_workers
+    global_bucket = TokenBucket(rate, rate)
+    per_chat_interval = chat_interval
@@ -0,0 +1,91 @@
+import threading
+from typing import Callable, Dict, List, Literal, Optional, Tuple
+from logger import log
+
+# callback data protocol: "<prefix><action>:<argument>", for example "ks:15" - show schedule of source 15
+# source names are never put into callback data (they may be longer than telegram's 64 bytes),
+# every name gets an integer id instead. Ids are append-only and saved to database,
+# so buttons of old messages keep working after links refresh and restart
+
+prefix = "k"
+
+db = None
+
+# action code -> handler(call, argument)
+handlers: Dict[str, Callable] = dict()
+
+# id -> (source_type, name) and back
+names: List[Optional[Tuple[str, str]]] = []
+name_ids: Dict[Tuple[str, str], int] = dict()
+names_lock = threading.Lock()
+
+# registers callback handler for action code
+def handler(action: str):
+    def decorator(func: Callable):
+        handlers[action] = func
+        return func
+    return decorator
+
+def encode(action: str, argument = "") -> str:
+    return f"{prefix}{action}:{argument}"
+
+# returns (action, argument), None if data is not ours
+def decode(data: str) -> Optional[Tuple[str, str]]:
+    if not data or not data.startswith(prefix):
+        return None
+    action, sep, argument = data[len(prefix):].partition(":")
+    if not sep:
+        return None
+    return action, argument
+
+# calls handler of callback query, returns False if there is no handler for it
+def dispatch(call) -> bool:
+    decoded = decode(call.data)
+    if decoded is None:
+        return False
+    func = handlers.get(decoded[0])
+    if func is None:
+        return False
+    func(call, decoded[1])
+    return True
+
+def name_id(source_type: Literal["group", "lecturer", "room"], name: str) -> int:
+    with names_lock:
+        return name_ids[(source_type, name)]
+
+# (source_type, name) of id, None if id is unknown
+def name_by_id(n) -> Optional[Tuple[str, str]]:
+    try:
+        n = int(n)
+    except ValueError:
+        return None
+    with names_lock:
+        return names[n] if 0 <= n < len(names) else None
+
+# api links listener, gives ids to new names
+def register_names(links: dict) -> None:
+    new = []
+    with names_lock:
+        for source_type in ("group", "lecturer", "room"):
+            for name in (links.get(f"s_{source_type}") or {}):
+                if (source_type, name) in name_ids:
+                    continue
+                n = len(names)
+                names.append((source_type, name))
+                name_ids[(source_type, name)] = n
+                new.append((n, source_type, name))
+    if new:
+        db.add_callback_names(new)
+        log("trash", f"Callback ids for {len(new)} new names")
+
+# loads saved ids, new names get theirs from register_names() links listener
+def init_callbacks(database) -> None:
+    global db
+
+    db = database
+    with names_lock:
+        for n, source_type, name in db.get_callback_names():
+            while len(names) <= n:
+                names.append(None)
+            names[n] = (source_type, name)
+            name_ids[(source_type, name)] = n
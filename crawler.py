@@ -0,0 +1,104 @@
+import time, threading
+from typing import Optional
+from logger import log
+import kitis_api as api
+
+# links dictionaries walked by crawler and their schedule source types
+crawl_sources = {
+    "s_group":      "group",
+    "s_lecturer":   "lecturer",
+    "s_room":       "room"
+}
+
+# crawl progress, shown by admin command
+progress = {
+    "round":        0,
+    "total":        0,
+    "done":         0,
+    "failed":       0,
+    "current":      "",
+    "started":      0.0,
+    "finished":     0.0,
+    "duration":     0.0
+}
+# per-source fetch timestamps, (source_type, source) -> time of last successful fetch
+fetch_times = dict()
+progress_lock = threading.Lock()
+
+interval: float = 1800
+delay: float = 1.0
+stop_event = threading.Event()
+crawler_thread: Optional[threading.Thread] = None
+
+# walks every schedule page once and puts results into api cache
+def crawl_once() -> None:
+    # copy so links refresh does not break iteration
+    queue = [(source_type, source)
+        for links_key, source_type in crawl_sources.items()
+        for source in list((api.links.get(links_key) or {}).keys())]
+
+    with progress_lock:
+        progress["round"]   += 1
+        progress["total"]   = len(queue)
+        progress["done"]    = 0
+        progress["failed"]  = 0
+        progress["started"] = time.time()
+    log("trash", f"Crawler: round {progress['round']} started, {len(queue)} pages")
+
+    for source_type, source in queue:
+        if stop_event.is_set():
+            return
+        with progress_lock:
+            progress["current"] = f"{source_type} {source}"
+
+        data = api.fetch_schedule(source_type, source)
+        # cache listeners (snapshots, notifier) may take a while, status() must not wait for them
+        if data:
+            api.cache_schedule(source_type, source, data)
+        with progress_lock:
+            if data:
+                fetch_times[(source_type, source)] = time.time()
+                progress["done"] += 1
+            else:
+                progress["failed"] += 1
+        # politeness delay, so host is not hammered
+        stop_event.wait(delay)
+
+    with progress_lock:
+        progress["current"]     = ""
+        progress["finished"]    = time.time()
+        progress["duration"]    = progress["finished"] - progress["started"]
+    log("ok", f"Crawler: round {progress['round']} finished in {round(progress['duration'])} s, {progress['failed']} failed")
+
+def crawl_loop() -> None:
+    while not stop_event.is_set():
+        try:
+            crawl_once()
+        except Exception as e:
+            log("fail", f"Crawler: round failed: {e}")
+        stop_event.wait(interval)
+
+# returns copy of current progress with some extra info
+def status() -> dict:
+    with progress_lock:
+        result = dict(progress)
+        result["running"] = crawler_thread is not None and crawler_thread.is_alive()
+        result["oldest"] = min(fetch_times.values()) if fetch_times else 0.0
+        result["cached"] = len(fetch_times)
+    return result
+
+# start crawler thread
+def start_crawler(crawl_interval: float = interval, crawl_delay: float = delay) -> None:
+    global crawler_thread, interval, delay
+
+    interval = crawl_interval
+    delay = crawl_delay
+    if crawler_thread and crawler_thread.is_alive():
+        return
+    stop_event.clear()
+    crawler_thread = threading.Thread(target=crawl_loop, name="crawler", daemon=True)
+    crawler_thread.start()
+    log("trash", f"Crawler started (interval {interval} s, delay {delay} s)")
+
+def stop_crawler() -> None:
+    stop_event.set()
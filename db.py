@@ -1,12 +1,33 @@
-import sqlite3
+import sqlite3, threading, time, queue
+from collections import OrderedDict
 from requests import check_compatibility
-from typing import Union
+from typing import Any, Callable, Optional, Union
+from logger import log
+import metrics
 
 class database:
 
-    def __init__(self, db_file):
-        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+    def __init__(self, db_file, user_cache_size: int = 10000, flush_interval: float = 0.2, max_batch: int = 500):
+        self.db_file = db_file
+        # this connection is used only by writer thread (and here, before it starts)
+        self.connection = self._connect(check_same_thread=False)
         self.cursor = self.connection.cursor()
+        # protects user cache
+        self.lock = threading.RLock()
+        # write-through LRU cache of user rows, user_id -> {column: value}
+        self.users = OrderedDict()
+        self.user_cache_size = user_cache_size
+        # readers get their own connection in every thread
+        self.local = threading.local()
+        # write-behind queue, writes are committed in batches by writer thread
+        # items are (func(cursor), waiter or None)
+        self.writes = queue.Queue()
+        # number of writes queued or taken by writer but not committed yet
+        # queue itself is empty while writer holds a batch, so it can not be used for this
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
         # create a new database table if not exists
         self.cursor.execute("""
 CREATE TABLE IF NOT EXISTS users (
@@ -17,56 +38,308 @@ CREATE TABLE IF NOT EXISTS users (
                             join_date DATETIME NOT NULL DEFAULT ((DATETIME('now'))),
                             last_schedule_request_time REAL DEFAULT 0,
                             last_group_request_time REAL DEFAULT 0,
-                            last_ping_request_time REAL DEFAULT 0)
+                            last_ping_request_time REAL DEFAULT 0,
+                            notify INTEGER DEFAULT 1)
+""")
+        # broadcasts and their receivers, so interrupted broadcasts can be resumed
+        self.cursor.execute("""
+CREATE TABLE IF NOT EXISTS broadcasts (
+                            id INTEGER PRIMARY KEY,
+                            text TEXT,
+                            file_id TEXT,
+                            admin_id INTEGER,
+                            created REAL NOT NULL,
+                            finished REAL)
+""")
+        self.cursor.execute("""
+CREATE TABLE IF NOT EXISTS broadcast_targets (
+                            broadcast_id INTEGER NOT NULL,
+                            user_id INTEGER NOT NULL,
+                            status TEXT NOT NULL DEFAULT 'pending',
+                            error TEXT,
+                            PRIMARY KEY (broadcast_id, user_id))
+""")
+        # ids of source names used in callback data, append-only so buttons of old messages keep working
+        self.cursor.execute("""
+CREATE TABLE IF NOT EXISTS callback_names (
+                            id INTEGER PRIMARY KEY,
+                            source_type TEXT NOT NULL,
+                            name TEXT NOT NULL,
+                            UNIQUE (source_type, name))
+""")
+        # parsed schedules, one row per (source, update_time) so old versions are kept
+        self.cursor.execute("""
+CREATE TABLE IF NOT EXISTS schedules (
+                            source_type TEXT NOT NULL,
+                            source TEXT NOT NULL,
+                            update_time TEXT NOT NULL,
+                            first_fetched REAL NOT NULL,
+                            fetched REAL NOT NULL,
+                            data TEXT NOT NULL,
+                            PRIMARY KEY (source_type, source, update_time))
 """)
         # here goes checks for all new columns that were added with updates
         self.add_column_if_not_exists('last_ping_request_time', 'REAL', 0)
+        self.add_column_if_not_exists('notify', 'INTEGER', 1)
+
+        self.writer = threading.Thread(target=self._writer, name="db-writer", daemon=True)
+        self.writer.start()
+
+    def _connect(self, check_same_thread: bool = True) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_file, check_same_thread=check_same_thread, timeout=30)
+        # WAL lets readers work while writer commits, NORMAL is safe with WAL and much faster than FULL
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute('PRAGMA cache_size=-8000')
+        return connection
+
+    # cursor of this thread's own read connection
+    def _reader(self) -> sqlite3.Cursor:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self._connect()
+            self.local.connection = connection
+        return connection.cursor()
+
+    # writer thread, commits queued writes in batches
+    def _writer(self):
+        while True:
+            item = self.writes.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            # collect more writes, but do not keep anyone waiting for commit
+            while len(batch) < self.max_batch and batch[-1][1] is None:
+                try:
+                    item = self.writes.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self.writes.put(None)
+                    break
+                batch.append(item)
+
+            started = time.perf_counter()
+            for func, waiter in batch:
+                try:
+                    result = func(self.cursor) if func else None
+                    if waiter:
+                        waiter["result"] = result
+                except Exception as e:
+                    log("fail", f"Database write failed: {e}")
+                    if waiter:
+                        waiter["error"] = e
+            try:
+                self.connection.commit()
+            except Exception as e:
+                log("fail", f"Database commit failed: {e}")
+            metrics.observe("db_commit", time.perf_counter() - started)
+            written = sum(1 for func, _ in batch if func)
+            with self.pending_lock:
+                self.pending -= written
+            metrics.inc("db_writes", n=written)
+            for _, waiter in batch:
+                if waiter:
+                    waiter["done"].set()
+
+    # queue write, it is committed by writer thread a bit later
+    def _write(self, func: Callable[[sqlite3.Cursor], Any]) -> None:
+        with self.pending_lock:
+            self.pending += 1
+        self.writes.put((func, None))
+
+    # queue write and wait until it is committed, returns what func returned
+    def _write_sync(self, func: Optional[Callable[[sqlite3.Cursor], Any]]) -> Any:
+        waiter = {"done": threading.Event(), "result": None, "error": None}
+        if func:
+            with self.pending_lock:
+                self.pending += 1
+        self.writes.put((func, waiter))
+        waiter["done"].wait()
+        if waiter["error"]:
+            raise waiter["error"]
+        return waiter["result"]
+
+    # wait until all queued writes are committed
+    # reads wait for it, so it is timed apart from the reads themselves
+    def flush(self):
+        with metrics.timed("db_flush"):
+            self._write_sync(None)
+
+    # timed SELECT on reader connection of this thread, returns all rows
+    def _read(self, label: str, sql: str, params: tuple = ()) -> list:
+        with metrics.timed("db_read", label):
+            return self._reader().execute(sql, params).fetchall()
 
     # guess what does this do
     def add_column_if_not_exists(self, c_name: str, c_type: str, c_default=None):
-        # fetch all columns from database
-        columns = [info[1] for info in self.cursor.execute('PRAGMA table_info(users)').fetchall()]
-        # add new column if there is not
-        if c_name not in columns:
-            # DEFAULT is set
-            if c_default is not None:
-                self.cursor.execute(f'ALTER TABLE users ADD COLUMN {c_name} {c_type} DEFAULT {c_default}')
-            # DEFAULT is not set
-            else:
-                self.cursor.execute(f'ALTER TABLE users ADD COLUMN {c_name} {c_type}')
-        return self.connection.commit()
+        with self.lock:
+            # fetch all columns from database
+            columns = [info[1] for info in self.cursor.execute('PRAGMA table_info(users)').fetchall()]
+            # add new column if there is not
+            if c_name not in columns:
+                # DEFAULT is set
+                if c_default is not None:
+                    self.cursor.execute(f'ALTER TABLE users ADD COLUMN {c_name} {c_type} DEFAULT {c_default}')
+                # DEFAULT is not set
+                else:
+                    self.cursor.execute(f'ALTER TABLE users ADD COLUMN {c_name} {c_type}')
+                # cached rows do not have new column
+                self.users.clear()
+            return self.connection.commit()
+
+    # get full user row from cache, load it from database if not cached
+    def get_user(self, user_id: Union[int, str]) -> Optional[dict]:
+        uid = int(user_id)
+        with self.lock:
+            row = self.users.get(uid)
+            if row is not None:
+                self.users.move_to_end(uid)
+                metrics.inc("user_cache", "hit")
+                return row
+            metrics.inc("user_cache", "miss")
+            # row may have writes that are not committed yet
+            if self.pending:
+                self.flush()
+            with metrics.timed("db_read", "get_user"):
+                result = self._reader().execute('SELECT * FROM users WHERE user_id = ?', (uid,))
+                values = result.fetchone()
+            if values is None:
+                return None
+            row = dict(zip([d[0] for d in result.description], values))
+            self.users[uid] = row
+            if len(self.users) > self.user_cache_size:
+                self.users.popitem(last=False)
+            return row
 
     # Check if user exists
     def user_exists(self, user_id: Union[int, str]):
-        uid = f"{user_id}"
-        result = self.cursor.execute('SELECT id FROM users WHERE user_id = ?', (user_id,))
-        return bool(len(result.fetchall()))
+        return self.get_user(user_id) is not None
 
     # Check if user has group
     def user_has_group(self, user_id: Union[int, str]):
-        result = self.cursor.execute('SELECT user_group FROM users WHERE user_id = ?', (user_id,))
-        return bool(len(result.fetchall()))
+        return self.get_user(user_id) is not None
 
     # Add user to database
     def add_user(self, user_id: Union[int, str], username):
-        self.cursor.execute('INSERT INTO users (`user_id`, `username`, `last_schedule_request_time`, `last_group_request_time`) VALUES (?, ?, ?, ?)', (user_id, username, 0, 0))
-        return self.connection.commit()
+        with self.lock:
+            self._write(lambda c: c.execute('INSERT INTO users (`user_id`, `username`, `last_schedule_request_time`, `last_group_request_time`) VALUES (?, ?, ?, ?)', (user_id, username, 0, 0)))
+            # row is loaded with database defaults on next read
+            self.users.pop(int(user_id), None)
 
     # set value in given column
     def set_value(self, user_id: Union[int, str], column: str, value):
-        self.cursor.execute(f"UPDATE users SET {column} = ? WHERE user_id = ?", (value, user_id))
-        return self.connection.commit()
+        with self.lock:
+            self._write(lambda c: c.execute(f"UPDATE users SET {column} = ? WHERE user_id = ?", (value, user_id)))
+            row = self.users.get(int(user_id))
+            if row is not None:
+                row[column] = value
+
+    # set values in given column for many users in one transaction, `values` is [(value, user_id)]
+    def set_values(self, column: str, values: list):
+        with self.lock:
+            self._write(lambda c: c.executemany(f"UPDATE users SET {column} = ? WHERE user_id = ?", values))
+            for value, user_id in values:
+                row = self.users.get(int(user_id))
+                if row is not None:
+                    row[column] = value
 
     # get value from given column
     def get_value(self, user_id: Union[int, str], column: str):
-        result = self.cursor.execute(f'SELECT {column} FROM users WHERE user_id = ?', (user_id,))
-        return result.fetchone()[0]
+        return self.get_user(user_id)[column]
 
     # get all values of given column
     def get_all_values(self, column: str):
-        result = self.cursor.execute(f'SELECT {column} FROM users')
-        return result.fetchall()
+        self.flush()
+        return self._read("get_all_values", f'SELECT {column} FROM users')
+
+    # get IDs of users of given group who want schedule change notifications
+    def get_subscribers(self, group: str):
+        self.flush()
+        return [row[0] for row in self._read("get_subscribers", 'SELECT user_id FROM users WHERE user_group = ? AND notify = 1', (group,))]
+
+    # save new broadcast with its receivers, returns broadcast id
+    def add_broadcast(self, text: str, file_id: str, admin_id, user_ids: list) -> int:
+        def insert(c: sqlite3.Cursor) -> int:
+            c.execute('INSERT INTO broadcasts (`text`, `file_id`, `admin_id`, `created`) VALUES (?, ?, ?, ?)', (text, file_id, admin_id, time.time()))
+            bid = c.lastrowid
+            c.executemany('INSERT INTO broadcast_targets (`broadcast_id`, `user_id`) VALUES (?, ?)', [(bid, uid) for uid in user_ids])
+            return bid
+        return self._write_sync(insert)
+
+    # set delivery status (sent, unreachable, failed) of one receiver
+    def set_broadcast_target(self, broadcast_id: int, user_id: Union[int, str], status: str, error: str = ""):
+        self._write(lambda c: c.execute('UPDATE broadcast_targets SET status = ?, error = ? WHERE broadcast_id = ? AND user_id = ?', (status, error, broadcast_id, user_id)))
+
+    def finish_broadcast(self, broadcast_id: int):
+        self._write(lambda c: c.execute('UPDATE broadcasts SET finished = ? WHERE id = ?', (time.time(), broadcast_id)))
+
+    # (id, text, file_id, admin_id) of broadcasts that were not finished
+    def get_unfinished_broadcasts(self):
+        self.flush()
+        return self._read("get_unfinished_broadcasts", 'SELECT id, text, file_id, admin_id FROM broadcasts WHERE finished IS NULL ORDER BY id')
+
+    # receivers who did not get broadcast yet
+    def get_broadcast_pending(self, broadcast_id: int):
+        self.flush()
+        return [row[0] for row in self._read("get_broadcast_pending", "SELECT user_id FROM broadcast_targets WHERE broadcast_id = ? AND status = 'pending'", (broadcast_id,))]
+
+    # (user_id, status, error) of receivers broadcast was not delivered to
+    def get_broadcast_failed(self, broadcast_id: int):
+        self.flush()
+        return self._read("get_broadcast_failed", "SELECT user_id, status, error FROM broadcast_targets WHERE broadcast_id = ? AND status IN ('unreachable', 'failed')", (broadcast_id,))
+
+    # (id, source_type, name) of all names used in callback data
+    def get_callback_names(self):
+        self.flush()
+        return self._read("get_callback_names", 'SELECT id, source_type, name FROM callback_names ORDER BY id')
+
+    # save new names, `names` is [(id, source_type, name)]
+    def add_callback_names(self, names: list):
+        self._write(lambda c: c.executemany('INSERT OR IGNORE INTO callback_names (`id`, `source_type`, `name`) VALUES (?, ?, ?)', names))
+
+    # save schedule version, if this version is saved already only its fetch time is updated
+    def save_schedule(self, source_type: str, source: str, update_time: str, fetched: float, data: str):
+        self._write(lambda c: c.execute("""
+INSERT INTO schedules (`source_type`, `source`, `update_time`, `first_fetched`, `fetched`, `data`) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (source_type, source, update_time) DO UPDATE SET fetched = excluded.fetched
+""", (source_type, source, update_time, fetched, fetched, data)))
+
+    # update fetch time of saved schedule version
+    def touch_schedule(self, source_type: str, source: str, update_time: str, fetched: float):
+        self._write(lambda c: c.execute('UPDATE schedules SET fetched = ? WHERE source_type = ? AND source = ? AND update_time = ?', (fetched, source_type, source, update_time)))
+
+    # (source_type, source, update_time, fetched, data) of the latest version of every schedule fetched after `since`
+    def get_latest_schedules(self, since: float = 0):
+        self.flush()
+        # sqlite takes bare columns from the row with MAX()
+        return self._read("get_latest_schedules", 'SELECT source_type, source, update_time, MAX(fetched), data FROM schedules GROUP BY source_type, source HAVING MAX(fetched) >= ?', (since,))
+
+    # (update_time, first_fetched, fetched) of all saved versions of schedule, newest first
+    def get_schedule_history(self, source_type: str, source: str):
+        self.flush()
+        return self._read("get_schedule_history", 'SELECT update_time, first_fetched, fetched FROM schedules WHERE source_type = ? AND source = ? ORDER BY first_fetched DESC', (source_type, source))
+
+    # data of schedule version that was actual at `timestamp`, None if there is no such version
+    def get_schedule_at(self, source_type: str, source: str, timestamp: float) -> Optional[str]:
+        self.flush()
+        rows = self._read("get_schedule_at", 'SELECT data FROM schedules WHERE source_type = ? AND source = ? AND first_fetched <= ? ORDER BY first_fetched DESC LIMIT 1', (source_type, source, timestamp))
+        return rows[0][0] if rows else None
+
+    # delete versions not fetched since `before`, the latest version of every schedule is kept
+    def prune_schedules(self, before: float):
+        self._write(lambda c: c.execute("""
+DELETE FROM schedules WHERE fetched < ? AND fetched < (
+    SELECT MAX(s.fetched) FROM schedules s WHERE s.source_type = schedules.source_type AND s.source = schedules.source)
+""", (before,)))
 
     # CLose database connection. Just for fun i guess
     def close(self):
+        # already closed (polling stop and then atexit)
+        if not self.writer.is_alive():
+            return
+        # commit everything that is still queued
+        self.writes.put(None)
+        self.writer.join()
         self.connection.close()
@@ -0,0 +1,167 @@
+import queue, threading
+from collections import deque
+from typing import Callable, Collection, Dict, List, Literal, Set
+import telebot as tb
+from logger import log
+import metrics
+
+# update fields that carry chat, in order of checking
+chat_fields = ("message", "edited_message", "channel_post", "edited_channel_post", "my_chat_member", "chat_member", "chat_join_request")
+# update fields that only carry user
+user_fields = ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer")
+
+def chat_key(update: tb.types.Update) -> int:
+    """Returns id of chat the update belongs to, falls back to update_id"""
+    for field in chat_fields:
+        obj = getattr(update, field, None)
+        if obj is not None:
+            return obj.chat.id
+    call = update.callback_query
+    if call is not None:
+        return call.message.chat.id if call.message else call.from_user.id
+    for field in user_fields:
+        obj = getattr(update, field, None)
+        if obj is not None:
+            user = getattr(obj, "from_user", None) or getattr(obj, "user", None)
+            if user is not None:
+                return user.id
+    return update.update_id
+
+def update_kind(update: tb.types.Update, commands: Collection[str] = ()) -> str:
+    """Command name for known commands, "other" for unknown ones, update field name for everything else.
+    Unknown commands share one label, otherwise anyone could create new metric series"""
+    message = update.message
+    if message is not None and message.text and message.text.startswith("/"):
+        command = message.text.split(maxsplit=1)[0].split("@")[0][1:]
+        return f"/{command}" if command in commands else "other"
+    for field in chat_fields + ("callback_query",) + user_fields:
+        if getattr(update, field, None) is not None:
+            return field
+    return "unknown"
+
+class ChatDispatcher:
+    """Pool of worker threads for updates.
+    Every chat has its own FIFO of pending updates and is taken by one worker at a time,
+    so updates of the same chat are processed in order, while different chats are processed in parallel
+    and a slow handler blocks only its own chat.
+    At most `max_backlog` updates wait for processing, updates with already seen update_id are dropped"""
+
+    def __init__(self, workers: int, process: Callable[[List[tb.types.Update]], None], max_backlog: int = 1000, dedup_size: int = 10000,
+                 commands: Callable[[], Collection[str]] = frozenset):
+        self.process = process
+        # names of registered commands, for handler latency labels
+        self.commands = commands
+        # chat key -> pending updates, chat is here while it has pending updates or is being processed
+        self.chats: Dict[int, deque] = dict()
+        # chats with pending updates that no worker has taken yet
+        self.ready: queue.Queue = queue.Queue()
+        self.chats_lock = threading.Lock()
+        # notified when last chat is done, for stop()
+        self.idle = threading.Condition(self.chats_lock)
+        # free places in backlog, taken on submit and given back after processing
+        self.backlog = threading.Semaphore(max_backlog)
+        # recently accepted update ids, telegram may deliver the same update again
+        self.seen: deque = deque(maxlen=dedup_size)
+        self.seen_ids: set = set()
+        self.seen_lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+        for n in range(max(1, workers)):
+            t = threading.Thread(target=self._worker, name=f"dispatcher-{n}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, update: tb.types.Update, block: bool = True) -> Literal["accepted", "duplicate", "full"]:
+        """Queue update for processing. If backlog is full, waits for free place
+        or returns "full" right away when `block` is False"""
+        with self.seen_lock:
+            if update.update_id in self.seen_ids:
+                metrics.inc("updates", "duplicate")
+                return "duplicate"
+        if not self.backlog.acquire(blocking=block):
+            metrics.inc("updates", "shed")
+            return "full"
+        with self.seen_lock:
+            # same update may come again while this one waited for backlog
+            if update.update_id in self.seen_ids:
+                self.backlog.release()
+                metrics.inc("updates", "duplicate")
+                return "duplicate"
+            if len(self.seen) == self.seen.maxlen:
+                self.seen_ids.discard(self.seen[0])
+            self.seen.append(update.update_id)
+            self.seen_ids.add(update.update_id)
+        metrics.inc("updates", "accepted")
+        key = chat_key(update)
+        with self.chats_lock:
+            pending = self.chats.get(key)
+            if pending is None:
+                self.chats[key] = deque((update,))
+                self.ready.put(key)
+            # chat is waiting or being processed, its worker takes this update later
+            else:
+                pending.append(update)
+        return "accepted"
+
+    def depth(self) -> int:
+        """Number of updates waiting in all chats"""
+        with self.chats_lock:
+            return sum(len(pending) for pending in self.chats.values())
+
+    def stop(self) -> None:
+        """Process already queued updates and stop workers"""
+        with self.idle:
+            while self.chats:
+                self.idle.wait()
+        for _ in self.threads:
+            self.ready.put(None)
+        for t in self.threads:
+            t.join()
+
+    def _worker(self) -> None:
+        while True:
+            key = self.ready.get()
+            if key is None:
+                return
+            with self.chats_lock:
+                update = self.chats[key].popleft()
+            try:
+                with metrics.timed("handler", update_kind(update, self.commands())):
+                    self.process([update])
+            except Exception as e:
+                log("fail", f"Dispatcher: failed to process update {update.update_id}: {e}")
+            finally:
+                self.backlog.release()
+                # one update at a time, then chat goes to the end of line, so busy chats do not starve others
+                with self.chats_lock:
+                    if self.chats[key]:
+                        self.ready.put(key)
+                    else:
+                        del self.chats[key]
+                        if not self.chats:
+                            self.idle.notify_all()
+
+class PooledTeleBot(tb.TeleBot):
+    """TeleBot that hands updates to ChatDispatcher instead of processing them on polling/webhook thread.
+    Handlers themselves run non-threaded inside dispatcher workers"""
+
+    def __init__(self, token: str, workers: int = 8, max_backlog: int = 1000, **kwargs):
+        kwargs["threaded"] = False
+        super().__init__(token, **kwargs)
+        self.dispatcher = ChatDispatcher(workers, super().process_new_updates, max_backlog, commands=self.command_names)
+        self.commands: Set[str] = set()
+        self.commands_handlers = 0
+
+    # commands of registered message handlers, rebuilt when handlers are added
+    def command_names(self) -> Set[str]:
+        if self.commands_handlers != len(self.message_handlers):
+            self.commands = {command for handler in self.message_handlers for command in (handler["filters"].get("commands") or ())}
+            self.commands_handlers = len(self.message_handlers)
+        return self.commands
+
+    # polling waits when backlog is full, so telegram keeps updates until we are ready
+    # telebot moves offset only in process_new_updates that now runs later on worker,
+    # so it is moved here, otherwise polling gets the same updates again right away
+    def process_new_updates(self, updates: List[tb.types.Update]) -> None:
+        for update in updates:
+            self.dispatcher.submit(update)
+            self.last_update_id = max(self.last_update_id, update.update_id)
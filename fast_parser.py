@@ -0,0 +1,293 @@
+import re, html
+from typing import Iterator, Optional, Union
+
+# fast parsing backend for schedule pages
+# instead of building full BeautifulSoup tree it tokenizes page with one regex
+# and builds tiny tree only for parts we actually read: first h1, div.ref and table.inf
+# tree building follows bs4 html.parser rules (end tag closes nearest open tag with the same name,
+# unmatched end tags are ignored), so results are identical to kitis_api.parse_soup_schedule
+
+# bs4 html.parser void elements
+void_tags = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem",
+    "meta", "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame",
+    "image", "isindex", "nextid", "spacer"
+}
+raw_text_tags = {"script", "style"}
+preserve_whitespace_tags = {"pre", "textarea"}
+ascii_spaces = str.maketrans("", "", "\x20\x0a\x09\x0c\x0d")
+
+re_token = re.compile(r"""
+    (?P<comment><!--.*?(?:-->|$))
+    |(?P<decl><[!?][^>]*>)
+    |</(?P<end>[a-zA-Z][^\s/>]*)[^>]*>
+    |<(?P<start>[a-zA-Z][^\s/>]*)(?P<attrs>(?:[^>"']|"[^"]*"|'[^']*')*)>
+    |(?P<text>[^<]+|<)
+""", re.S | re.X)
+re_class = re.compile(r"""(?:^|[\s"'])class\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.I)
+re_href = re.compile(r"""(?:^|[\s"'])href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.I)
+re_meta_charset = re.compile(rb"""<\s*meta[^>]+charset\s*=\s*["']?([^>]*?)[ /;'">]""", re.I)
+
+class Node:
+    """Minimal html element. `children` holds nodes and strings"""
+    __slots__ = ("name", "classes", "raw_attrs", "children")
+
+    def __init__(self, name: str, raw_attrs: str):
+        self.name = name
+        self.raw_attrs = raw_attrs
+        self.children = []
+        # bs4 keeps value of the last duplicated attribute
+        found = re_class.findall(raw_attrs) if "class" in raw_attrs.lower() else None
+        if found:
+            value = next(v for v in found[-1] if v) if any(found[-1]) else ""
+            self.classes = html.unescape(value).split()
+        else:
+            self.classes = None
+
+    def get(self, attr: str) -> Optional[Union[str, list]]:
+        if attr == "class":
+            return self.classes
+        if attr == "href":
+            found = re_href.findall(self.raw_attrs)
+            if not found:
+                return None
+            return html.unescape(next((v for v in found[-1] if v), ""))
+        raise KeyError(attr)
+
+    def has_class(self, cls: Optional[str]) -> bool:
+        return cls is None or (self.classes is not None and cls in self.classes)
+
+    def find_all(self, name: str, cls: Optional[str] = None) -> list:
+        return [n for n in self.descendants() if n.name == name and n.has_class(cls)]
+
+    def find(self, name: str, cls: Optional[str] = None) -> Optional["Node"]:
+        for n in self.descendants():
+            if n.name == name and n.has_class(cls):
+                return n
+        return None
+
+    def descendants(self) -> Iterator["Node"]:
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
+                if isinstance(child, Node):
+                    yield child
+                    stack.append(iter(child.children))
+                    break
+            else:
+                stack.pop()
+
+    def strings(self) -> Iterator[str]:
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
+                if isinstance(child, Node):
+                    stack.append(iter(child.children))
+                    break
+                yield child
+            else:
+                stack.pop()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.strings())
+
+    def get_text(self, separator: str = "") -> str:
+        return separator.join(self.strings())
+
+# same order of guesses as bs4 UnicodeDammit: BOM, declared charset, utf-8, then cp1251 for this site
+def decode(content: bytes) -> str:
+    if content.startswith(b"\xef\xbb\xbf"):
+        return content[3:].decode("utf-8", errors="replace")
+    guesses = []
+    match = re_meta_charset.search(content, 0, max(2048, len(content) // 20))
+    if match:
+        guesses.append(match.group(1).decode("ascii", errors="ignore").strip().lower())
+    guesses.append("utf-8")
+    for encoding in guesses:
+        try:
+            return content.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return content.decode("cp1251", errors="replace")
+
+def build(content: Union[bytes, str], targets: list) -> list:
+    """Build trees for the first element matching each of `targets` (list of (tag, class) tuples).
+    Stops tokenizing as soon as all targets are closed"""
+    doc = decode(content) if isinstance(content, bytes) else content
+    found: list = [None] * len(targets)
+    left = len(targets)
+    # open elements, (name, node or None if not captured, is it one of targets)
+    stack: list = []
+    capturing = 0
+    text_parts: list = []
+    # void elements closed right after start tag, their end tags are ignored once
+    already_closed: list = []
+
+    # every tag and comment ends current string, like bs4 endData()
+    def flush_text():
+        text = "".join(text_parts)
+        text_parts.clear()
+        if "&" in text:
+            text = html.unescape(text)
+        # bs4 replaces whitespace-only strings with single newline or space
+        if not text.translate(ascii_spaces) and not any(n in preserve_whitespace_tags for n, _, _ in stack):
+            text = "\n" if "\n" in text else " "
+        stack[-1][1].children.append(text)
+
+    def end_tag(name: str, check_already_closed: bool):
+        nonlocal capturing, left
+        if check_already_closed and name in already_closed:
+            already_closed.remove(name)
+            return
+        if text_parts:
+            flush_text()
+        # close nearest open element with this name, ignore if there is none
+        for i in range(len(stack) - 1, -1, -1):
+            if stack[i][0] == name:
+                for _, node, is_target in stack[i:]:
+                    if node is not None:
+                        capturing -= 1
+                    if is_target:
+                        left -= 1
+                del stack[i:]
+                break
+
+    pos = 0
+    end = len(doc)
+    while pos < end and left:
+        m = re_token.match(doc, pos)
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == "text":
+            if capturing:
+                text_parts.append(m.group("text"))
+        elif kind == "attrs":
+            if text_parts:
+                flush_text()
+            name = m.group("start").lower()
+            attrs = m.group("attrs")
+            node = Node(name, attrs) if capturing else None
+            is_target = False
+            for i, (t_name, t_cls) in enumerate(targets):
+                if found[i] is None and t_name == name:
+                    if node is None:
+                        node = Node(name, attrs)
+                    if node.has_class(t_cls):
+                        found[i] = node
+                        is_target = True
+                        break
+            if capturing:
+                stack[-1][1].children.append(node)
+            elif not is_target:
+                node = None
+            stack.append((name, node, is_target))
+            if node is not None:
+                capturing += 1
+
+            if attrs.endswith("/"):
+                end_tag(name, False)
+            elif name in void_tags:
+                end_tag(name, False)
+                already_closed.append(name)
+            # raw text, skip to its end tag
+            elif name in raw_text_tags:
+                close = re.compile(rf"</{name}\s*>", re.I).search(doc, pos)
+                body_end = close.start() if close else end
+                if node is not None and body_end > pos:
+                    node.children.append(doc[pos:body_end])
+                pos = body_end
+        elif kind == "end":
+            end_tag(m.group("end").lower(), True)
+        else:
+            # comments and declarations split strings too
+            if text_parts:
+                flush_text()
+    if text_parts:
+        flush_text()
+    return found
+
+# get_source_links() for fast backend
+def parse_links(content: Union[bytes, str], base: str) -> dict:
+    result = dict()
+    t = build(content, [("table", "inf")])[0]
+    rows = t.find_all("tr")
+    for tr in rows:
+        td = tr.find_all("td", "ur")
+        if not td:
+            continue
+        group = td[1].find("a", "z0")
+        group_name = group.text
+        group_link = group.get("href")
+
+        result[f"{group_name}"] = f"""{base}{group_link}"""
+
+    return result
+
+def get_lesson_info(td_with_lesson: list) -> tuple:
+    z1 = ""
+    z2 = ""
+    z3 = ""
+    for z in td_with_lesson:
+        cls = z.classes[0]
+        if cls == "z1":
+            z1 += z.text + " "
+        elif cls == "z2":
+            z2 += z.text + " "
+        elif cls == "z3":
+            z3 += z.text + " "
+    if not z2:
+        z2 = "Кабинет не указан"
+    return (z1.strip(), z2.strip(), z3.strip())
+
+def append_lesson(day: dict, td: Node, n: str, subgroup: str) -> None:
+    td_with_lesson = td.find_all("a")
+    if not td_with_lesson:
+        return
+    z1, z2, z3 = get_lesson_info(td_with_lesson)
+    day["lessons"].append({
+        "n":        n,
+        "z1":       z1,
+        "z2":       z2,
+        "z3":       z3,
+        "subgroup": subgroup
+    })
+
+# parse_soup_schedule() for fast backend
+def parse_schedule(content: Union[bytes, str], t_days: dict) -> dict:
+    h1, ref, table = build(content, [("h1", None), ("div", "ref"), ("table", "inf")])
+    days = dict()
+    day = None
+
+    for tr in table.find_all("tr")[2:]:
+        tds = tr.find_all("td")
+        # skip if empty row
+        if tds[0].classes[0] == "hd0":
+            continue
+        n_tds = len(tds)
+        # first lesson in this day
+        if (n_tds == 4 or n_tds == 3) and len(tds[0].text) > 1:
+            current_date, weekday_short = tds[0].get_text(separator=" ").split()
+            day = {"weekday": t_days[weekday_short], "lessons": list()}
+            days[current_date] = day
+            lesson_number = tds[1].text
+            if n_tds == 4:
+                append_lesson(day, tds[2], lesson_number, "1")
+                append_lesson(day, tds[3], lesson_number, "2")
+            else:
+                append_lesson(day, tds[2], lesson_number, "0")
+        # different lessons for both subgroups
+        elif n_tds == 3:
+            lesson_number = tds[0].text
+            append_lesson(day, tds[1], lesson_number, "1")
+            append_lesson(day, tds[2], lesson_number, "2")
+        # only lesson and its number
+        elif n_tds == 2:
+            lesson_number = tds[0].text
+            append_lesson(day, tds[1], lesson_number, "0")
+
+    return {
+        "header":       h1.text,
+        "update_time":  ref.text.strip(),
+        "days":         days
+    }
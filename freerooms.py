@@ -0,0 +1,113 @@
+import threading, datetime
+from typing import Dict, List, Optional, Set, Tuple
+from logger import log
+import kitis_api as api
+
+# free rooms finder: occupancy index over schedules of all rooms
+# every room has a bit, every (date, lesson number) has a bitset of occupied rooms,
+# every date has a bitset of rooms which schedule covers it (published). Free rooms are covered & ~occupied.
+# index is updated per room when its update_time changes, room schedules are brought by crawler
+
+numbers = ("1", "2", "3", "4", "5", "6", "7")
+
+# bit -> room name and back, append-only so bits of rooms never change
+rooms: List[str] = []
+room_bits: Dict[str, int] = dict()
+# (date, lesson number) -> bitset of occupied rooms
+occupied: Dict[Tuple[str, str], int] = dict()
+# date -> bitset of rooms with published schedule for this date
+covered: Dict[str, int] = dict()
+# room -> (update_time, dates, occupied slots) which are in index now, to remove them on update
+indexed: Dict[str, Tuple[str, Set[str], Set[Tuple[str, str]]]] = dict()
+index_lock = threading.Lock()
+
+def room_bit(room: str) -> int:
+    bit = room_bits.get(room)
+    if bit is None:
+        bit = room_bits[room] = len(rooms)
+        rooms.append(room)
+    return bit
+
+# puts room schedule into index, previous version of this room is removed first
+def update_room(room: str, data: dict) -> None:
+    dates = set(data["days"])
+    slots = {(date, lesson["number"]) for date, info in data["days"].items() for lesson in info["lessons"]}
+
+    with index_lock:
+        old = indexed.get(room)
+        if old and old[0] == data["update_time"]:
+            return
+        mask = 1 << room_bit(room)
+        if old:
+            for date in old[1]:
+                covered[date] &= ~mask
+            for slot in old[2]:
+                occupied[slot] &= ~mask
+        for date in dates:
+            covered[date] = covered.get(date, 0) | mask
+        for slot in slots:
+            occupied[slot] = occupied.get(slot, 0) | mask
+        indexed[room] = (data["update_time"], dates, slots)
+        # dates of old versions nobody covers anymore
+        if old:
+            for date in old[1] - dates:
+                if not covered[date]:
+                    del covered[date]
+            for slot in old[2] - slots:
+                if not occupied[slot]:
+                    del occupied[slot]
+
+# api cache listener
+def on_cache(source_type: str, source: str, data: dict, fetched: float) -> None:
+    if source_type == "room":
+        update_room(source, data)
+
+def names(mask: int) -> List[str]:
+    result = []
+    while mask:
+        low = mask & -mask
+        result.append(rooms[low.bit_length() - 1])
+        mask ^= low
+    return sorted(result, key=str.casefold)
+
+# names of free rooms at lesson `number` of `date` ("13.10.2025"), None if no room schedule covers this date
+def free_rooms(date: str, number: str) -> Optional[List[str]]:
+    with index_lock:
+        mask = covered.get(date)
+        if not mask:
+            return None
+        return names(mask & ~occupied.get((date, number), 0))
+
+# number of rooms with schedule in index and number of all known rooms
+def coverage() -> Tuple[int, int]:
+    with index_lock:
+        return len(indexed), len((api.links.get("s_room") or {}))
+
+# /freerooms arguments in any order: date ("13.10" or "13.10.2025") and lesson number
+# returns (date, lesson number or None for every lesson), None if arguments are wrong
+def parse_args(args: List[str], today: datetime.date) -> Optional[Tuple[datetime.date, Optional[str]]]:
+    day = today
+    number = None
+    for arg in args:
+        if arg in numbers:
+            number = arg
+            continue
+        try:
+            parts = arg.split(".")
+            if len(parts) == 2:
+                day = datetime.date(today.year, int(parts[1]), int(parts[0]))
+            elif len(parts) == 3:
+                day = datetime.date(int(parts[2]), int(parts[1]), int(parts[0]))
+            else:
+                return None
+        except ValueError:
+            return None
+    return day, number
+
+# fills index with room schedules already in api cache (restored snapshots)
+def init_freerooms() -> None:
+    with api.cache_lock:
+        entries = [(source, entry["data"]) for (source_type, source), entry in api.schedule_cache.items() if source_type == "room"]
+    for source, data in entries:
+        update_room(source, data)
+    log("trash", f"Free rooms index: {len(entries)} rooms")
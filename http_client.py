@@ -0,0 +1,123 @@
+import time, random, threading
+import requests
+from collections import deque
+from typing import Optional
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+class HttpClient:
+    """Thread-safe http client for schedule site.
+    Sized connection pool, limited concurrent requests per host, separate connect/read timeouts,
+    jittered exponential backoff and session rotation. Keeps timings of last requests"""
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        per_host: int = 4,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 10.0,
+        backoff_base: float = 1.0,
+        backoff_cap: float = 10.0,
+        timings_size: int = 500):
+        self.pool_size = pool_size
+        self.per_host = per_host
+        self.timeout = (connect_timeout, read_timeout)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        # fake user-agent for sessions, loading it is slow so it is created with the first session
+        self.ua = None
+
+        self.lock = threading.Lock()
+        # created on first request
+        self.session: Optional[requests.Session] = None
+        self.host_limits: dict = dict()
+        # (time, host, status code or exception name, elapsed seconds)
+        self.timings: deque = deque(maxlen=timings_size)
+        # set on shutdown, interrupts backoff waits
+        self.closed = threading.Event()
+
+    def _new_session(self) -> requests.Session:
+        if self.ua is None:
+            from fake_useragent import UserAgent
+            self.ua = UserAgent()
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, pool_block=True)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        # update headers so we can make "human" or "real" requests
+        s.headers.update({
+            "Accept-Language":  "en-US,en;q=0.5",
+            "Cache-Control":    "no-cache",
+            "Connection":       "keep-alive",
+            "Pragma":           "no-cache",
+            "Priority":         "u=0, i",
+            "User-Agent":       f"{self.ua.random}"
+        })
+        return s
+
+    def rotate(self, old: Optional[requests.Session] = None) -> None:
+        """Replace session with a new one with another user-agent.
+        If `old` is given, session is rotated only if no other thread already did it"""
+        with self.lock:
+            if old is not None and self.session is not old:
+                return
+            # old session is not closed, other threads may still use it
+            self.session = self._new_session()
+
+    def _host_limit(self, host: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            limit = self.host_limits.get(host)
+            if limit is None:
+                limit = threading.BoundedSemaphore(self.per_host)
+                self.host_limits[host] = limit
+            return limit
+
+    def get(self, link: str) -> requests.Response:
+        """GET request, raises requests exceptions like requests.get"""
+        host = urlsplit(link).netloc
+        session = self.session
+        if session is None:
+            with self.lock:
+                if self.session is None:
+                    self.session = self._new_session()
+                session = self.session
+        with self._host_limit(host):
+            started = time.perf_counter()
+            try:
+                r = session.get(link, timeout=self.timeout)
+            except requests.RequestException as e:
+                self.timings.append((time.time(), host, type(e).__name__, time.perf_counter() - started))
+                raise
+        self.timings.append((time.time(), host, r.status_code, time.perf_counter() - started))
+        return r
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before retry `attempt` (starts with 0), exponential with full jitter"""
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep that is interrupted on close(). Returns False if client was closed"""
+        return not self.closed.wait(seconds)
+
+    def close(self) -> None:
+        self.closed.set()
+
+    def stats(self) -> dict:
+        """Summary of recent requests"""
+        timings = list(self.timings)
+        if not timings:
+            return {"count": 0, "errors": 0, "p50": 0.0, "p95": 0.0, "max": 0.0, "last": None, "codes": {}}
+        elapsed = sorted(t[3] for t in timings)
+        codes = dict()
+        for t in timings:
+            codes[t[2]] = codes.get(t[2], 0) + 1
+        return {
+            "count":    len(timings),
+            "errors":   sum(1 for t in timings if not isinstance(t[2], int)),
+            "p50":      elapsed[len(elapsed) // 2],
+            "p95":      elapsed[min(len(elapsed) - 1, int(len(elapsed) * 0.95))],
+            "max":      elapsed[-1],
+            "last":     timings[-1],
+            "codes":    codes
+        }
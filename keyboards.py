@@ -0,0 +1,100 @@
+import json, threading
+from typing import Dict, List, Literal
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from logger import log
+import callbacks
+
+# selection keyboards for groups, lecturers and rooms
+# built once per links refresh, split into pages and kept as serialized markup,
+# so sending or paging a keyboard does not build anything
+
+# keyboard code -> (source type, callback action of name buttons)
+# "G" picks user group, others show schedule of selected source
+keyboard_sources = {
+    "G":    ("group",    "g"),
+    "g":    ("group",    "s"),
+    "l":    ("lecturer", "s"),
+    "r":    ("room",     "s")
+}
+# keyboard code for /scheduleby source type
+show_keyboards = {
+    "group":    "g",
+    "lecturer": "l",
+    "room":     "r"
+}
+
+page_size: int = 30
+row_width: int = 3
+
+# keyboard code -> serialized markup of every page
+pages: Dict[str, List[str]] = dict()
+# keyboard code -> serialized markup of letter index (list of pages with their first and last letters)
+indexes: Dict[str, str] = dict()
+pages_lock = threading.Lock()
+
+# without \u escapes payload is about two times smaller
+def serialize(markup: InlineKeyboardMarkup) -> str:
+    return json.dumps(markup.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+def letter(name: str) -> str:
+    return name[:1].upper() or "?"
+
+def build_pages(keyboard: str, names: list) -> None:
+    source_type, action = keyboard_sources[keyboard]
+    names = sorted(names, key=str.casefold)
+    chunks = [names[i:i + page_size] for i in range(0, len(names), page_size)] or [[]]
+    # first and last letters of every page, for index and page titles
+    ranges = [letter(c[0]) if c and letter(c[0]) == letter(c[-1]) else f"{letter(c[0])}–{letter(c[-1])}" if c else "---" for c in chunks]
+
+    built = []
+    for n, chunk in enumerate(chunks):
+        markup = InlineKeyboardMarkup(row_width=row_width)
+        markup.add(*[InlineKeyboardButton(name, callback_data=callbacks.encode(action, callbacks.name_id(source_type, name))) for name in chunk])
+        if len(chunks) > 1:
+            markup.row(
+                InlineKeyboardButton("◀", callback_data=callbacks.encode("p", f"{keyboard}{(n - 1) % len(chunks)}")),
+                InlineKeyboardButton(f"{ranges[n]} ({n + 1}/{len(chunks)})", callback_data=callbacks.encode("i", keyboard)),
+                InlineKeyboardButton("▶", callback_data=callbacks.encode("p", f"{keyboard}{(n + 1) % len(chunks)}"))
+            )
+        built.append(serialize(markup))
+
+    index = InlineKeyboardMarkup(row_width=4)
+    index.add(*[InlineKeyboardButton(r, callback_data=callbacks.encode("p", f"{keyboard}{n}")) for n, r in enumerate(ranges)])
+
+    with pages_lock:
+        pages[keyboard] = built
+        indexes[keyboard] = serialize(index)
+
+# api links listener, rebuilds all keyboards
+def build_keyboards(links: dict) -> None:
+    for keyboard, (source_type, _) in keyboard_sources.items():
+        build_pages(keyboard, list((links.get(f"s_{source_type}") or {}).keys()))
+    log("trash", f"Keyboards built: {', '.join(f'{k} {len(p)} pages' for k, p in pages.items())}")
+
+# serialized markup of page `n`, n is wrapped around
+def page(keyboard: str, n: int = 0) -> str:
+    with pages_lock:
+        p = pages[keyboard]
+        return p[n % len(p)]
+
+def index(keyboard: str) -> str:
+    with pages_lock:
+        return indexes[keyboard]
+
+# keyboard that shows schedule of selected source
+def show_page(source_type: Literal["group", "lecturer", "room"], n: int = 0) -> str:
+    return page(show_keyboards[source_type], n)
+
+# markup for "p" callback argument (keyboard code and page number), None if argument is broken
+def page_markup(argument: str):
+    try:
+        return page(argument[0], int(argument[1:]))
+    except (KeyError, ValueError, IndexError):
+        return None
+
+# markup for "i" callback argument (keyboard code), None if argument is broken
+def index_markup(argument: str):
+    try:
+        return index(argument)
+    except KeyError:
+        return None
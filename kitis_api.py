@@ -1,8 +1,14 @@
-import requests, json, time, logger
-from typing import Literal, Optional, Tuple
-from bs4 import BeautifulSoup
-from fake_useragent import UserAgent
+import requests, json, os, time, threading, logger
+from typing import TYPE_CHECKING, Any, Callable, Literal, Optional, Tuple
 from logger import log
+from http_client import HttpClient
+import fast_parser
+import lessons
+import metrics
+
+# bs4 is slow to import and only needed for "bs4" parser backend
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
 
 # some dictionaries for formatting
 t_days = {
@@ -54,102 +60,199 @@ statuses = {
 
 # create links dictionary
 links = dict()
-
-# fake user-agent for sessions
-ua = UserAgent()
+links_file: str = "links.json"
+# called as listener(links) after links are refreshed from the site
+links_listeners = list()
+
+# schedule cache, (source_type, source) -> {"data": dict, "fetched": float}
+# entries younger than ttl are fresh, entries younger than max_age are served stale
+# while one background refresh runs, anything older is fetched synchronously
+schedule_cache = dict()
+cache_lock = threading.Lock()
+cache_refreshing = set()
+cache_ttl: float = 600
+cache_max_age: float = 3600
+
+# called as listener(source_type, source, old, new) when cached schedule gets new update_time
+schedule_listeners = list()
+# called as listener(source_type, source, data, fetched) every time schedule is put into cache
+cache_listeners = list()
+
+# page parsing backend, "fast" or "bs4"
+parser_backend: str = "fast"
+
+# single-flight, concurrent callers of the same link wait for one request and parse
+# link -> {"done": threading.Event, "result": ...}
+inflight = dict()
+inflight_lock = threading.Lock()
+
+# http client, created in init_api()
+client: HttpClient = None
+# retries after timeout
+retries: int = 3
+
+# circuit breaker for the site
+# "closed" - requests go to the site as usual
+# "open" - site is down (`breaker_threshold` failed requests in a row), requests fail right away
+# and background prober checks the site every `probe_interval` seconds until it answers again
+breaker = {
+    "state":        "closed",
+    "failures":     0,
+    "opened":       0.0,
+    # (time, status code or exception name, elapsed seconds) of the last probe
+    "last_probe":   None
+}
+breaker_lock = threading.Lock()
+breaker_threshold: int = 5
+probe_interval: float = 15
+
+def host_down() -> bool:
+    return breaker["state"] == "open"
+
+def breaker_success() -> None:
+    with breaker_lock:
+        breaker["failures"] = 0
+
+def breaker_failure() -> None:
+    with breaker_lock:
+        breaker["failures"] += 1
+        if breaker["state"] == "open" or breaker["failures"] < breaker_threshold:
+            return
+        breaker["state"] = "open"
+        breaker["opened"] = time.time()
+    metrics.inc("breaker", "open")
+    log("fail", f"Site is down after {breaker_threshold} failed requests, serving cached schedules", True, "Site is down", 'e')
+    threading.Thread(target=probe_loop, name="breaker-probe", daemon=True).start()
+
+# checks the site until it answers, then closes breaker
+def probe_loop() -> None:
+    link = config["links"].get("index", config["links"]["base"])
+    while client.wait(probe_interval):
+        started = time.perf_counter()
+        try:
+            r = client.get(link)
+            result = r.status_code
+        except requests.RequestException as e:
+            result = type(e).__name__
+        breaker["last_probe"] = (time.time(), result, time.perf_counter() - started)
+        if isinstance(result, int) and result < 500:
+            with breaker_lock:
+                breaker["state"] = "closed"
+                breaker["failures"] = 0
+            metrics.inc("breaker", "close")
+            log("ok", f"Site is up again after {round(time.time() - breaker['opened'])} s", True, "Site is up", 'i')
+            return
 
 def update_session() -> None:
-    global s
-
-    # make new session
-    s = requests.Session()
-    # update headers so we can make "human" or "real" requests
-    headers = {
-        "Accept-Language":  "en-US,en;q=0.5",
-        "Cache-Control":    "no-cache",
-        "Connection":       "keep-alive",
-        "Pragma":           "no-cache",
-        "Priority":         "u=0, i",
-        "User-Agent":       f"{ua.random}"
-    }
-    s.headers.update(headers)
-
-# tries a connection to link
-def try_request(link: str) -> Optional[requests.Response]:
-    global s
+    client.rotate()
 
+# client.get() that counts status codes and errors
+def counted_get(link: str) -> requests.Response:
     try:
-        r = s.get(link, timeout=5)
-        return r
-    except (requests.ConnectTimeout, requests.ReadTimeout) as e:
-        r = retry_connection(link)
-        if not r:
-            return None
-        else:
-            return r
+        r = client.get(link)
+    except requests.RequestException as e:
+        metrics.inc("upstream_status", type(e).__name__)
+        raise
+    metrics.inc("upstream_status", str(r.status_code))
+    return r
+
+# tries a connection to link, fails right away if site is down
+def try_request(link: str) -> Optional[requests.Response]:
+    if host_down():
+        metrics.inc("upstream_status", "breaker_open")
+        return None
+    with metrics.timed("upstream"):
+        try:
+            r = counted_get(link)
+        except (requests.ConnectTimeout, requests.ReadTimeout, requests.ConnectionError) as e:
+            # 5xx response is falsy, but it is still a response, breaker check below handles it
+            r = retry_connection(link)
+    if r is None or r.status_code >= 500:
+        breaker_failure()
+    else:
+        breaker_success()
+    return r
 
 # session_test() using this method if getting timeout or status code 401/403
-# basically just tries to connect to host 3 times
+# basically just tries to connect to host few times with jittered exponential backoff
 def retry_connection(link: str) -> Optional[requests.Response]:
-    global s
-
     log("warn", "Got timeout, retrying...")
-    sleep_increment = 0
-    attemps = 0
-    while attemps < 3:
-        attemps += 1
-        sleep_increment += 2
+    for attempt in range(retries):
+        # other requests found out site is down meanwhile
+        if host_down():
+            return None
+        session = client.session
+        metrics.inc("upstream_retry")
         try:
-            r = s.get(link, timeout=5)
+            r = counted_get(link)
             log("trash", "Got response")
             return r
-        except Exception as e:
-            if type(e) == requests.ConnectTimeout or type(e) == requests.ReadTimeout:
-                log("warn", f"Timed out again, retrying after {sleep_increment} seconds with new session...")
-                update_session()
-                time.sleep(sleep_increment)
-                continue
-            else:
-                log("fail", f"Unexpected error: {e}")
+        except (requests.ConnectTimeout, requests.ReadTimeout, requests.ConnectionError) as e:
+            delay = client.backoff(attempt)
+            log("warn", f"{type(e).__name__} again, retrying after {delay:.1f} seconds with new session...")
+            client.rotate(session)
+            if not client.wait(delay):
                 return None
-    else:
-        log("fail", "Host is not accessible")
-        return None
+        except Exception as e:
+            log("fail", f"Unexpected error: {e}")
+            return None
+    log("fail", "Host is not accessible")
+    return None
 
 # method for testing host connection and updating session if necessary
 def session_test() -> int:
-    global s
-
     log("trash", "Testing session...")
     test_host = "http://94.72.18.202:8083/index.htm"
     r = try_request(test_host)
-    if not r:
+    if r is None:
         return 2
 
     if r.status_code == 200:
         log("ok", "Session is ok, host is available")
         return 0
-    else:
-        attempts = 0
-        while r.status_code == 401 or r.status_code == 403 and attempts < 10:
-            attempts += 1
-            log("warn", f"Host returned {r.status_code}, updating session...")
-            update_session()
-            if not retry_connection(test_host):
-                return 2
-        else:
-            if attempts == 10:
-                log("fail", "Failed to update session!")
-                return 10
-            elif not r.ok:
-                log("fail", f"Host returned {r.status_code}")
-                return 1
-        log("ok", "Updated session")
-        return 0
+
+    attempts = 0
+    while r.status_code in (401, 403) and attempts < 10:
+        attempts += 1
+        log("warn", f"Host returned {r.status_code}, updating session...")
+        update_session()
+        r = try_request(test_host)
+        if r is None:
+            return 2
+    if r.status_code in (401, 403):
+        log("fail", "Failed to update session!")
+        return 10
+    if not r.ok:
+        log("fail", f"Host returned {r.status_code}")
+        return 1
+    log("ok", "Updated session")
+    return 0
+
+# runs func only once for all concurrent callers with the same key, they all get its result
+def single_flight(key: str, func: Callable[..., Any], *args) -> Any:
+    with inflight_lock:
+        call = inflight.get(key)
+        leader = call is None
+        if leader:
+            call = {"done": threading.Event(), "result": None}
+            inflight[key] = call
+
+    # someone is already doing this, just wait
+    if not leader:
+        log("trash", f"Waiting for in-flight request: {key}")
+        call["done"].wait()
+        return call["result"]
+
+    try:
+        call["result"] = func(*args)
+    finally:
+        with inflight_lock:
+            inflight.pop(key, None)
+        call["done"].set()
+    return call["result"]
 
 # maybe i will sometime make so message updates in realtime while request or retry is performing
 def ping(link: str) -> dict:
-    global s
     result = dict()
 
     r = try_request(link)
@@ -165,15 +268,46 @@ def ping(link: str) -> dict:
     result["time"] = round(r.elapsed.microseconds / 1000) / 1000    # elapsed time in seconds, %.3f format
     return result
 
+# state of the site from breaker and the last request, without making a new request
+# (falls back to ping() only if there were no requests yet)
+def health(link: str) -> dict:
+    if host_down():
+        probe = breaker["last_probe"]
+        return {
+            "status":   "Сайт недоступен",
+            "code":     probe[1] if probe else "---",
+            "time":     f"{probe[2]:.3f}" if probe else "-.---",
+            "down_for": time.time() - breaker["opened"],
+            "checked":  time.time() - probe[0] if probe else None
+        }
+
+    last = client.stats()["last"]
+    if last is None:
+        result = ping(link)
+        result["checked"] = 0.0
+        return result
+    checked, code, elapsed = time.time() - last[0], last[2], last[3]
+    return {
+        "status":   statuses.get(code, f"Код {code}") if isinstance(code, int) else "Ошибка соединения",
+        "code":     code,
+        "time":     f"{elapsed:.3f}",
+        "checked":  checked
+    }
+
 # s_ stands for schedule, r_ for records
 def get_source_links(source: Literal["s_group", "s_lecturer", "s_room", "r_group", "r_lecturer"]) -> Optional[dict]:
-    result = dict()
     link = config["links"][f"{source}"]
+    return single_flight(link, load_source_links, link)
 
+def load_source_links(link: str) -> Optional[dict]:
     r = try_request(link)
     if not r:
         return None
-    soup = BeautifulSoup(r.content, "html.parser")
+    return parse_links_page(r.content)
+
+# takes soup of schedule list page and returns {name: link}
+def parse_soup_links(soup: "BeautifulSoup") -> dict:
+    result = dict()
 
     # this is the soup part
     t = soup.find("table", class_="inf")
@@ -190,6 +324,22 @@ def get_source_links(source: Literal["s_group", "s_lecturer", "s_room", "r_group
 
     return result
 
+# parse pages with selected backend
+# "bs4" is the original BeautifulSoup parser, kept as reference for the fast one
+def parse_links_page(content: bytes) -> dict:
+    with metrics.timed("parse_links", parser_backend):
+        if parser_backend == "bs4":
+            from bs4 import BeautifulSoup
+            return parse_soup_links(BeautifulSoup(content, "html.parser"))
+        return fast_parser.parse_links(content, config["links"]["base"])
+
+def parse_schedule_page(content: bytes) -> dict:
+    with metrics.timed("parse_schedule", parser_backend):
+        if parser_backend == "bs4":
+            from bs4 import BeautifulSoup
+            return parse_soup_schedule(BeautifulSoup(content, "html.parser"))
+        return fast_parser.parse_schedule(content, t_days)
+
 def get_lesson_info(td_with_lesson) -> Tuple[str, str, str]:
     # these z is class names from html
     z1 = ""
@@ -223,7 +373,7 @@ def append_schedule_lesson(
     return result
 
 # takes soup and returns normalized dictionary
-def parse_soup_schedule(soup: BeautifulSoup) -> dict:
+def parse_soup_schedule(soup: "BeautifulSoup") -> dict:
     result = dict()
 
     # get fields from soup
@@ -299,15 +449,18 @@ def parse_soup_schedule(soup: BeautifulSoup) -> dict:
 
     return result
 
-def get_schedule(source_type: Literal["group", "lecturer", "room"], source: str) -> Optional[dict]:
-    result = dict()
+# fetches and parses schedule page, bypassing cache
+def fetch_schedule(source_type: Literal["group", "lecturer", "room"], source: str) -> Optional[dict]:
     link = links[f"s_{source_type}"][source]
+    return single_flight(link, load_schedule, source_type, source, link)
+
+def load_schedule(source_type: Literal["group", "lecturer", "room"], source: str, link: str) -> Optional[dict]:
+    result = dict()
 
     r = try_request(link)
     if not r:
         return None
-    soup = BeautifulSoup(r.content, "html.parser")
-    data = parse_soup_schedule(soup)
+    data = parse_schedule_page(r.content)
 
     # fill result
     result["head"] = source
@@ -318,65 +471,201 @@ def get_schedule(source_type: Literal["group", "lecturer", "room"], source: str)
         result["days"][date] = dict()
         result["days"][date]["weekday"] = info["weekday"]
         result["days"][date]["lessons"] = list()
-    # fill dates
+    # fill dates, z fields mean different things for every source type
+    lesson_type = lessons.lesson_types[source_type]
     for date, info in dict(data["days"]).items():
+        bells = t_bells_monday if info["weekday"] == "Понедельник" else t_bells_week
+        day_lessons = result["days"][date]["lessons"]
         for lesson in list(data["days"][date]["lessons"]):
-            number  = lesson["n"]
-            bells   = t_bells_monday if info["weekday"] == "Понедельник" else t_bells_week
+            number = lesson["n"]
             if source_type == "group":
-                name        = lesson["z1"]
-                room        = lesson["z2"]
-                lecturer    = lesson["z3"]
-                subgroup    = lesson["subgroup"]
-                result["days"][date]["lessons"].append({
-                    "number":   number,
-                    "bells":    bells[number],
-                    "name":     name,
-                    "room":     room,
-                    "lecturer": lecturer,
-                    "subgroup": subgroup
-                })
-            elif source_type == "lecturer":
-                group       = lesson["z1"]
-                room        = lesson["z2"]
-                name     = lesson["z3"]
-                result["days"][date]["lessons"].append({
-                    "number":   number,
-                    "bells":    bells[number],
-                    "group":    group,
-                    "room":     room,
-                    "name":     name
-                })
-            elif source_type == "room":
-                lecturer    = lesson["z1"]
-                group       = lesson["z2"]
-                name        = lesson["z3"]
-                result["days"][date]["lessons"].append({
-                    "number":   number,
-                    "bells":    bells[number],
-                    "lecturer": lecturer,
-                    "group":    group,
-                    "name":     name
-                })
+                # name, room, lecturer, subgroup
+                day_lessons.append(lesson_type(number, bells[number], lesson["z1"], lesson["z2"], lesson["z3"], lesson["subgroup"]))
+            else:
+                # lecturer: group, room, name; room: lecturer, group, name
+                day_lessons.append(lesson_type(number, bells[number], lesson["z1"], lesson["z2"], lesson["z3"]))
     return result
 
+# puts fresh schedule into cache and notifies listeners if update_time changed
+def cache_schedule(source_type: Literal["group", "lecturer", "room"], source: str, data: dict) -> None:
+    fetched = time.time()
+    with cache_lock:
+        old = schedule_cache.get((source_type, source))
+        schedule_cache[(source_type, source)] = {
+            "data":     data,
+            "fetched":  fetched
+        }
+
+    for listener in cache_listeners:
+        try:
+            listener(source_type, source, data, fetched)
+        except Exception as e:
+            log("fail", f"Cache listener failed: {e}")
+
+    if old and old["data"]["update_time"] != data["update_time"]:
+        for listener in schedule_listeners:
+            try:
+                listener(source_type, source, old["data"], data)
+            except Exception as e:
+                log("fail", f"Schedule listener failed: {e}")
+
+# puts schedule saved before restart into cache, it is served until first refresh whatever its age is
+def restore_schedule(source_type: Literal["group", "lecturer", "room"], source: str, data: dict, fetched: float) -> None:
+    lessons.compact_schedule(source_type, data)
+    with cache_lock:
+        # do not overwrite anything fetched already
+        if (source_type, source) in schedule_cache:
+            return
+        schedule_cache[(source_type, source)] = {
+            "data":     data,
+            "fetched":  fetched,
+            "restored": True
+        }
+
+# refreshes one cache entry in background thread, only one refresh per entry at a time
+def refresh_schedule(source_type: Literal["group", "lecturer", "room"], source: str) -> None:
+    key = (source_type, source)
+    with cache_lock:
+        if key in cache_refreshing:
+            return
+        cache_refreshing.add(key)
+
+    def worker():
+        try:
+            data = fetch_schedule(source_type, source)
+            if data:
+                cache_schedule(source_type, source, data)
+                log("trash", f"Refreshed cached schedule: {source_type} {source}")
+            else:
+                log("warn", f"Failed to refresh cached schedule: {source_type} {source}")
+        finally:
+            with cache_lock:
+                cache_refreshing.discard(key)
+
+    threading.Thread(target=worker, name=f"refresh-{source_type}-{source}", daemon=True).start()
+
+# returns schedule from cache if possible, fetches it otherwise
+def get_schedule(source_type: Literal["group", "lecturer", "room"], source: str) -> Optional[dict]:
+    with cache_lock:
+        entry = schedule_cache.get((source_type, source))
+
+    if entry:
+        age = time.time() - entry["fetched"]
+        # fresh
+        if age < cache_ttl:
+            metrics.inc("schedule_cache", "fresh")
+            return entry["data"]
+        # stale, but still can be served
+        if age < cache_max_age or entry.get("restored"):
+            metrics.inc("schedule_cache", "stale")
+            refresh_schedule(source_type, source)
+            return entry["data"]
+
+    # site is down, last known schedule is better than nothing
+    if entry and host_down():
+        metrics.inc("schedule_cache", "fallback")
+        return entry["data"]
+
+    # no entry or too old
+    metrics.inc("schedule_cache", "miss")
+    data = fetch_schedule(source_type, source)
+    if data:
+        cache_schedule(source_type, source, data)
+    elif entry:
+        metrics.inc("schedule_cache", "fallback")
+        return entry["data"]
+    return data
+
+# seconds since cached schedule was fetched, None if it is not cached
+def schedule_age(source_type: Literal["group", "lecturer", "room"], source: str) -> Optional[float]:
+    with cache_lock:
+        entry = schedule_cache.get((source_type, source))
+    return time.time() - entry["fetched"] if entry else None
+
+# returns cached schedule without waiting for the site, None if it is not cached
+# nothing is refreshed here: it is called on every keystroke of inline query, crawler keeps cache warm
+def peek_schedule(source_type: Literal["group", "lecturer", "room"], source: str) -> Optional[dict]:
+    with cache_lock:
+        entry = schedule_cache.get((source_type, source))
+    return entry["data"] if entry else None
+
 # init method
 def init_api() -> None:
-    global config
+    global config, cache_ttl, cache_max_age, parser_backend, client, retries, breaker_threshold, probe_interval
 
     with open("config.json", 'r') as f:
         config = json.load(f)
 
-    update_session()
+    # cache settings (seconds), older configs may not have them
+    cache_cfg = config.get("cache", {})
+    cache_ttl       = cache_cfg.get("ttl", cache_ttl)
+    cache_max_age   = cache_cfg.get("max_age", cache_max_age)
+    parser_backend  = config.get("parser", parser_backend)
+
+    http_cfg = config.get("http", {})
+    retries = http_cfg.get("retries", retries)
+    breaker_cfg = config.get("breaker", {})
+    breaker_threshold   = breaker_cfg.get("threshold", breaker_threshold)
+    probe_interval      = breaker_cfg.get("probe_interval", probe_interval)
+    client = HttpClient(
+        pool_size       = http_cfg.get("pool_size", 10),
+        per_host        = http_cfg.get("per_host", 4),
+        connect_timeout = http_cfg.get("connect_timeout", 3.05),
+        read_timeout    = http_cfg.get("read_timeout", 10),
+        backoff_base    = http_cfg.get("backoff_base", 1),
+        backoff_cap     = http_cfg.get("backoff_cap", 10)
+    )
+
+    # serve links saved by previous run and refresh them in background
+    if load_links():
+        threading.Thread(target=refresh_links, name="links-refresh", daemon=True).start()
+    else:
+        refresh_links()
+
+# loads links saved by previous run, returns False if there are none
+def load_links() -> bool:
+    if not os.path.exists(links_file):
+        return False
+    try:
+        with open(links_file, 'r') as f:
+            saved = json.load(f)
+    except Exception as e:
+        log("warn", f"Can't load {links_file}: {e}")
+        return False
+    if not all(saved.get(key) for key in ("s_group", "s_lecturer", "s_room")):
+        return False
+    links.update(saved)
+    log("ok", f"Loaded links from {links_file}")
+    notify_links()
+    return True
+
+# calls every links listener, they are registered before init_api() so loaded links are seen too
+def notify_links() -> None:
+    for listener in links_listeners:
+        try:
+            listener(links)
+        except Exception as e:
+            log("fail", f"Links listener failed: {e}")
+
+# gets all links from the site and saves them, keeps old links if site is not available
+def refresh_links() -> bool:
     session_test()
 
-    with open("links.json", 'w') as f:
-        links["s_group"]      = get_source_links("s_group")
-        links["s_lecturer"]   = get_source_links("s_lecturer")
-        links["s_room"]       = get_source_links("s_room")
-        links["r_group"]      = get_source_links("r_group")
-        links["r_lecturer"]   = get_source_links("r_lecturer")
+    fresh = dict()
+    for key in ("s_group", "s_lecturer", "s_room", "r_group", "r_lecturer"):
+        fresh[key] = get_source_links(key)
+    if not all(fresh[key] for key in ("s_group", "s_lecturer", "s_room")):
+        log("fail", "Failed to refresh links")
+        return False
+
+    links.update(fresh)
+    # write to temporary file first, so links file is never half-written
+    with open(f"{links_file}.tmp", 'w') as f:
         json.dump(links, f, indent=4)
+    os.replace(f"{links_file}.tmp", links_file)
+    log("ok", "Links refreshed")
+    notify_links()
+    return True
 
 # main
 if __name__ == "__main__":
@@ -0,0 +1,82 @@
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Literal, Tuple, Type
+
+# compact lesson records for schedules held in memory
+# a lesson used to be a dict with its own copy of keys and strings, now it is a slotted object
+# and its strings (bells, names, rooms, people) are interned, so every schedule shares them.
+# lessons are read-only mappings, so lesson["name"], dict(lesson) and comparisons with dicts keep working
+
+class Lesson(Mapping):
+    """Read-only lesson record with dict interface"""
+    __slots__ = ()
+    fields: Tuple[str, ...] = ()
+
+    def __init__(self, *values: str):
+        for field, value in zip(self.fields, values):
+            object.__setattr__(self, field, sys.intern(value) if type(value) is str else value)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("lesson is read-only")
+
+    def __getitem__(self, key: str) -> str:
+        if key in self.fields:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def values_tuple(self) -> tuple:
+        return tuple(getattr(self, field) for field in self.fields)
+
+    def __eq__(self, other) -> bool:
+        if type(other) is type(self):
+            return self.values_tuple() == other.values_tuple()
+        if isinstance(other, Mapping):
+            return dict(self) == dict(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((type(self), self.values_tuple()))
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self)!r})"
+
+    def __reduce__(self):
+        return type(self), self.values_tuple()
+
+class GroupLesson(Lesson):
+    __slots__ = fields = ("number", "bells", "name", "room", "lecturer", "subgroup")
+
+class LecturerLesson(Lesson):
+    __slots__ = fields = ("number", "bells", "group", "room", "name")
+
+class RoomLesson(Lesson):
+    __slots__ = fields = ("number", "bells", "lecturer", "group", "name")
+
+lesson_types: Dict[str, Type[Lesson]] = {
+    "group":    GroupLesson,
+    "lecturer": LecturerLesson,
+    "room":     RoomLesson
+}
+
+# exact lesson types, `type(lesson) in lesson_classes` is much cheaper than isinstance() with abc
+lesson_classes = frozenset(lesson_types.values())
+
+# lesson from dict with the same keys, for schedules loaded from json
+def from_dict(source_type: Literal["group", "lecturer", "room"], lesson: dict) -> Lesson:
+    cls = lesson_types[source_type]
+    return cls(*(lesson[field] for field in cls.fields))
+
+# replaces lesson dicts of schedule with lesson records, returns the same schedule
+def compact_schedule(source_type: Literal["group", "lecturer", "room"], data: dict) -> dict:
+    for info in data["days"].values():
+        info["lessons"] = [
+            lesson if type(lesson) in lesson_classes else from_dict(source_type, lesson)
+            for lesson in info["lessons"]
+        ]
+    return data
@@ -1,11 +1,29 @@
-import requests, logging, time, json, traceback
-from typing import Literal
+import requests, time, json, traceback, sys, queue, threading, atexit
+from typing import Literal, Optional
 import regex_helper as rh
 
-logger = logging.getLogger(__name__)
 colored: bool = False
 ntfy_topic: str = ""
 
+# records are written by background thread, so log() never waits for disk or ntfy.sh
+# record is (tag, text, time, exc_info, (post_tag, post_title) or None)
+records: Optional[queue.Queue] = None
+writer_thread: Optional[threading.Thread] = None
+# log files, info gets every message, debug also gets tracebacks
+files: list = []
+debug_file = None
+# "trash" records dropped because queue was full
+dropped: int = 0
+
+# ntfy.sh notifications are sent as digests, at most one post every `ntfy_interval` seconds
+ntfy_interval: float = 10
+ntfy_pending: list = []
+ntfy_lock = threading.Lock()
+ntfy_wakeup = threading.Event()
+ntfy_max_pending: int = 50
+ntfy_timeout = (3.05, 10)
+stop_event = threading.Event()
+
 tags = {
     "ok":   "  OK  ",
     "info": " INFO ",
@@ -30,12 +48,15 @@ def init_logger(
     filename_info: str,
     filename_debug: str = "",
     colored_output: bool = False,
-    ntfy_topic_str: str = ""):
+    ntfy_topic_str: str = "",
+    queue_size: int = 10000,
+    ntfy_digest_interval: float = 10):
     """Initialize logger.
     `filename_info` must be provided and `filename_debug` is optional (provide `""` to disable it).
     `colored_output` adds ASCII escape codes (for example, `"\\033[30m"` is red), so use it with cat or tail command.
-    `ntfy_topic_str` is also optional. If you want to get notifications via ntfy.sh, then provide topic name like `"kitisbot_ntfy"`, not the full link!"""
-    global colors, colored, ntfy_topic
+    `ntfy_topic_str` is also optional. If you want to get notifications via ntfy.sh, then provide topic name like `"kitisbot_ntfy"`, not the full link!
+    `queue_size` limits number of records waiting for writer, `ntfy_digest_interval` is minimal time between ntfy.sh posts"""
+    global colors, colored, ntfy_topic, records, writer_thread, files, debug_file, ntfy_interval
 
     # load colors from config
     with open("config.json", 'r') as f:
@@ -49,40 +70,43 @@ def init_logger(
 
     # colored log output
     colored = colored_output
+    ntfy_interval = ntfy_digest_interval
 
-    logger.setLevel(logging.DEBUG)
-    # create file handler
-    fhandler_info = logging.FileHandler(filename_info)
-    fhandler_info.setLevel(logging.INFO)
-    # set formatter
-    formatter = logging.Formatter("%(message)s")
-    fhandler_info.setFormatter(formatter)
-    # add file handler to logger
-    logger.addHandler(fhandler_info)
-
+    files = [open(filename_info, 'a', encoding="utf-8")]
     if filename_debug:
-        fhandler_debug = logging.FileHandler(filename_debug)
-        fhandler_debug.setLevel(logging.DEBUG)
-        fhandler_debug.setFormatter(formatter)
-        logger.addHandler(fhandler_debug)
+        debug_file = open(filename_debug, 'a', encoding="utf-8")
+        files.append(debug_file)
 
     # separator
-    logger.info('-----------------------------------------')
+    for f in files:
+        f.write('-----------------------------------------\n')
+
+    records = queue.Queue(maxsize=queue_size)
+    stop_event.clear()
+    writer_thread = threading.Thread(target=writer, name="log-writer", daemon=True)
+    writer_thread.start()
+    threading.Thread(target=ntfy_sender, name="log-ntfy", daemon=True).start()
+    atexit.register(stop_logger)
 
     # test ntfy
     if ntfy_topic_str:
         # make a post request
-        test_ntfy = requests.post(
-            f"https://ntfy.sh/{ntfy_topic_str}",
-            data=f"This is a test message to check if provided ntfy.sh topic is correct. Bot is now launching...",
-            headers={
-                "Title": "ntfy.sh topic test",
-                "Priority": "min",
-                "Tags": f"{ntfy_tags['i']}"
-            }
-        )
+        try:
+            test_ntfy = requests.post(
+                f"https://ntfy.sh/{ntfy_topic_str}",
+                data=f"This is a test message to check if provided ntfy.sh topic is correct. Bot is now launching...",
+                headers={
+                    "Title": "ntfy.sh topic test",
+                    "Priority": "min",
+                    "Tags": f"{ntfy_tags['i']}"
+                },
+                timeout=ntfy_timeout
+            )
+            topic_ok = test_ntfy.ok
+        except requests.RequestException:
+            topic_ok = False
         # topic is ok
-        if test_ntfy.ok:
+        if topic_ok:
             # enable/disable ntfy.sh (global)
             ntfy_topic = ntfy_topic_str
             log("trash", "ntfy.sh topic is ok")
@@ -97,33 +121,134 @@ def log(
     will_notify: bool = False,
     post_title: str = 'kitisbot notification',
     post_tag: Literal['i', 'w', 'e'] = 'i'):
+    global dropped
+
+    # exception is taken here, writer thread does not have it
+    exc = sys.exc_info() if tag == "fail" else None
+    record = (tag, text, time.time(), exc, (post_tag, post_title) if will_notify else None)
 
-    # concat log message and print it
+    # not initialized or already stopped, write right away
+    if records is None or writer_thread is None or not writer_thread.is_alive():
+        write_records([record])
+        return
+
+    # trash is dropped under pressure, everything else waits for free space
+    if tag == "trash":
+        try:
+            records.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+    else:
+        records.put(record)
+
+# background writer, takes all queued records and writes them at once
+def writer():
+    reported = 0
+    while True:
+        batch = [records.get()]
+        while True:
+            try:
+                batch.append(records.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in batch
+        batch = [r for r in batch if r is not None]
+        if dropped != reported:
+            batch.append(("warn", f"Logger: queue is full, dropped {dropped - reported} trash records", time.time(), None, None))
+            reported = dropped
+        try:
+            write_records(batch)
+        except Exception as e:
+            print(f"Logger: failed to write records: {e}")
+        if stop:
+            return
+
+def format_record(tag: str, text: str, timestamp: float) -> str:
     if colored:
-        output = '\033[90m' + time.asctime() + '\033[0m ' + colors[tag] + '[' + tags[tag] + ']\033[0m > ' + text
-        print(output)
+        return '\033[90m' + time.asctime(time.localtime(timestamp)) + '\033[0m ' + colors[tag] + '[' + tags[tag] + ']\033[0m > ' + text
+    return time.asctime(time.localtime(timestamp)) + ' ['+ tags[tag] + '] > ' + text
+
+# short traceback of exception that was handled when record was made
+def format_traceback(exc) -> str:
+    if exc is None or exc[0] is None:
+        tb_full = "NoneType: None\n"
     else:
-        output = time.asctime() + ' ['+ tags[tag] + '] > ' + text
-        print(output)
-
-    # write message in log
-    if tag == "fail":      # error
-        logger.error(output)
-        # debug - write traceback
-        tb_full = traceback.format_exc()
-        tb_parts = tb_full.split("During handling of the above exception, another exception occurred:")
-        # extract filename, line number and line
-        match = rh.extract_regex(r'Traceback \(most recent call last\):\s*File (\S+),.*line (\d+).*\n\s+(.*)', tb_parts[-1])
-        tb = f"File: {match[0]}, line {match[1]}\n{match[2]}" if match else tb_parts[-1].strip()
-        logger.debug(f"Traceback:\n{tb}\nTraceback end\n")
-    elif tag == "warn":    # warning
-        logger.warning(output)
-    else:               # info
-        logger.info(output)
-
-    # post message to ntfy.sh if needed
-    if ntfy_topic != None and will_notify:
-        ntfy_post(post_tag, post_title, text)
+        tb_full = "".join(traceback.format_exception(*exc))
+    tb_parts = tb_full.split("During handling of the above exception, another exception occurred:")
+    # extract filename, line number and line
+    match = rh.extract_regex(r'Traceback \(most recent call last\):\s*File (\S+),.*line (\d+).*\n\s+(.*)', tb_parts[-1])
+    return f"File: {match[0]}, line {match[1]}\n{match[2]}" if match else tb_parts[-1].strip()
+
+def write_records(batch: list):
+    lines = []
+    debug_lines = []
+    for tag, text, timestamp, exc, notify in batch:
+        output = format_record(tag, text, timestamp)
+        lines.append(output)
+        if tag == "fail":
+            # debug - write traceback
+            debug_lines.append((len(lines), f"Traceback:\n{format_traceback(exc)}\nTraceback end\n"))
+        # post message to ntfy.sh if needed
+        if ntfy_topic and notify:
+            ntfy_queue(notify[0], notify[1], text)
+
+    print("\n".join(lines))
+    for f in files:
+        if f is debug_file and debug_lines:
+            # tracebacks go right after their records
+            parts = []
+            prev = 0
+            for n, tb in debug_lines:
+                parts.extend(lines[prev:n])
+                parts.append(tb)
+                prev = n
+            parts.extend(lines[prev:])
+            f.write("\n".join(parts) + "\n")
+        else:
+            f.write("\n".join(lines) + "\n")
+        f.flush()
+
+# flushes queued records and stops writer
+def stop_logger():
+    if records is not None and writer_thread is not None and writer_thread.is_alive():
+        records.put(None)
+        writer_thread.join()
+    stop_event.set()
+    ntfy_wakeup.set()
+
+def ntfy_queue(
+    tag: Literal['i', 'w', 'e'],
+    title: str,
+    text: str):
+    with ntfy_lock:
+        ntfy_pending.append((tag, title, text))
+        # keep the newest ones if ntfy.sh is down
+        if len(ntfy_pending) > ntfy_max_pending:
+            del ntfy_pending[0]
+    ntfy_wakeup.set()
+
+# sends pending notifications, several notifications are merged into one digest
+def ntfy_sender():
+    while not stop_event.is_set():
+        ntfy_wakeup.wait()
+        ntfy_wakeup.clear()
+        with ntfy_lock:
+            pending = list(ntfy_pending)
+            ntfy_pending.clear()
+        if pending:
+            if len(pending) == 1:
+                tag, title, text = pending[0]
+            else:
+                # the most important tag of digest
+                tag = min((p[0] for p in pending), key=lambda t: "ewi".index(t))
+                title = f"kitisbot: {len(pending)} notifications"
+                text = "\n\n".join(f"{p[1]}:\n{p[2]}" for p in pending)
+            try:
+                ntfy_post(tag, title, text)
+            except requests.RequestException as e:
+                print(f"Logger: failed to post to ntfy.sh: {e}")
+        # notifications that come meanwhile are collected into next digest
+        stop_event.wait(ntfy_interval)
 
 def ntfy_post(
     tag: Literal['i', 'w', 'e'],
@@ -132,12 +257,13 @@ def ntfy_post(
 
     requests.post(
         f"https://ntfy.sh/{ntfy_topic}",
-        data=f"{text}",
+        data=f"{text}".encode("utf-8"),
         headers={
             "Title": f"{title}",
             "Priority": f"{priorities[tag]}",
             "Tags": f"{ntfy_tags[tag]}"
-        }
+        },
+        timeout=ntfy_timeout
     )
 
 # for tests
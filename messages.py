@@ -0,0 +1,175 @@
+import time, threading
+from collections.abc import Mapping
+from typing import Literal
+import metrics
+import lessons
+
+# schedule message rendering, kept apart from bot.py so it can be used without running bot
+
+# rendered messages, (source_type, source) -> (update_time, message)
+# message is rendered again only when update_time of schedule changes
+rendered = dict()
+rendered_lock = threading.Lock()
+
+# rendered slices (/today, /tomorrow, /week), (source_type, source, kind, first date) -> (update_time, message)
+rendered_slices = dict()
+max_slices: int = 5000
+
+titles = {
+    "group":    "Расписание группы",
+    "lecturer": "Расписание преподавателя",
+    "room":     "Расписание аудитории"
+}
+
+# one line of schedule message
+# lesson fields are read as attributes, it is much faster than lesson["name"] of lesson record
+def format_lesson(source_type: Literal["group", "lecturer", "room"], lesson: Mapping) -> str:
+    if type(lesson) not in lessons.lesson_classes:
+        lesson = lessons.from_dict(source_type, lesson)
+    if source_type == "group":
+        return f"""<u>{lesson.number} Пара</u> - <i>{lesson.bells}</i> - {lesson.name} {f"({lesson.subgroup}) " if lesson.subgroup != "0" and not "Иностранный язык" in lesson.name else ""}- <i>{lesson.room}</i>"""
+    elif source_type == "lecturer":
+        return f"""<u>{lesson.number} Пара</u> - <i>{lesson.bells}</i> - <b>{lesson.group}</b> - {lesson.name} - <i>{lesson.room}</i>"""
+    else:
+        return f"""<u>{lesson.number} Пара</u> - <i>{lesson.bells}</i> - {lesson.lecturer} - <b>{lesson.group}</b> - {lesson.name}"""
+
+# generate schedule message from api.get_schedule() data
+def format_schedule(source_type: Literal["group", "lecturer", "room"], data: dict) -> str:
+    parts = [f"""{titles[source_type]} <b>{data["head"]}</b>\n"""]
+
+    for date, info in data["days"].items():
+        if not info["lessons"] and (info["weekday"] == "Суббота" or info["weekday"] == "Воскресенье"): continue
+
+        parts.append(f"""\n--------------------------\n\n{date} - <b>{info["weekday"]}</b>\n\n""")
+        for lesson in info["lessons"]:
+            parts.append(format_lesson(source_type, lesson))
+            parts.append("\n")
+
+    parts.append(f"""\n--------------------------\n<i>{data["update_time"]}</i>""")
+    return "".join(parts)
+
+# "5 мин.", "3 ч.", "2 дн."
+def format_age(seconds: float) -> str:
+    if seconds < 3600:
+        return f"{max(1, round(seconds / 60))} мин."
+    if seconds < 86400:
+        return f"{round(seconds / 3600)} ч."
+    return f"{round(seconds / 86400)} дн."
+
+# note for old schedule, it is shown while site is down or while schedule is refreshed (after restart)
+def format_stale_note(age: float, host_down: bool = True) -> str:
+    if host_down:
+        return f"""\n\n<i>⚠️ Сайт сейчас недоступен, расписание получено {format_age(age)} назад</i>"""
+    return f"""\n\n<i>Расписание получено {format_age(age)} назад</i>"""
+
+# same as format_schedule(), but cached until update_time of schedule changes
+def render_schedule(source_type: Literal["group", "lecturer", "room"], data: dict) -> str:
+    key = (source_type, data["head"])
+    with rendered_lock:
+        entry = rendered.get(key)
+    if entry and entry[0] == data["update_time"]:
+        metrics.inc("render_cache", "hit")
+        return entry[1]
+
+    metrics.inc("render_cache", "miss")
+    with metrics.timed("render", source_type):
+        msg = format_schedule(source_type, data)
+    with rendered_lock:
+        rendered[key] = (data["update_time"], msg)
+    return msg
+
+# cuts message to telegram length limit at the end of a line, so no html tag is cut
+def fit_message(msg: str, tail: str = "\n...") -> str:
+    if len(msg) <= 4096:
+        return msg
+    cut = msg.rfind("\n", 0, 4096 - len(tail))
+    return msg[:cut if cut > 0 else 4096 - len(tail)] + tail
+
+# message with some days of schedule, `days` is [(date, info)] from timetable index
+def format_days(source_type: Literal["group", "lecturer", "room"], data: dict, days: list, empty: str) -> str:
+    parts = [f"""{titles[source_type]} <b>{data["head"]}</b>\n"""]
+
+    for date, info in days:
+        # same as full schedule, empty weekends are not shown in week
+        if len(days) > 1 and not info["lessons"] and (info["weekday"] == "Суббота" or info["weekday"] == "Воскресенье"): continue
+        parts.append(f"""\n--------------------------\n\n{date} - <b>{info["weekday"]}</b>\n\n""")
+        if not info["lessons"]:
+            parts.append("Занятий нет\n")
+        for lesson in info["lessons"]:
+            parts.append(format_lesson(source_type, lesson))
+            parts.append("\n")
+    if not days:
+        parts.append(f"""\n{empty}\n""")
+
+    parts.append(f"""\n--------------------------\n<i>{data["update_time"]}</i>""")
+    return "".join(parts)
+
+# same as format_days(), but cached until update_time of schedule changes
+def render_days(source_type: Literal["group", "lecturer", "room"], data: dict, kind: str, first_date: str, days: list, empty: str) -> str:
+    key = (source_type, data["head"], kind, first_date)
+    with rendered_lock:
+        entry = rendered_slices.get(key)
+    if entry and entry[0] == data["update_time"]:
+        metrics.inc("render_cache", "hit")
+        return entry[1]
+
+    metrics.inc("render_cache", "miss")
+    with metrics.timed("render", kind):
+        msg = format_days(source_type, data, days, empty)
+    with rendered_lock:
+        # old dates are never asked again, just start over
+        if len(rendered_slices) >= max_slices:
+            rendered_slices.clear()
+        rendered_slices[key] = (data["update_time"], msg)
+    return msg
+
+# line about next lesson, `lesson` is timetable.next_lesson() result
+def format_next_lesson(source_type: Literal["group", "lecturer", "room"], lesson: tuple, today: str) -> str:
+    date, weekday, info, ongoing = lesson
+    when = "Сейчас идёт" if ongoing else "Следующая пара" + ("" if date == today else f" ({date}, {weekday.lower()})")
+    return f"""\n\n<b>{when}</b>:\n{format_lesson(source_type, info)}"""
+
+# free rooms message, `free` is [(lesson number, bells, free rooms or None if there is no data)]
+def format_free_rooms(date: str, weekday: str, free: list, indexed: int, total: int) -> str:
+    parts = [f"""Свободные аудитории на <b>{date}</b> - <b>{weekday}</b>\n"""]
+    for number, bells, rooms in free:
+        parts.append(f"""\n<u>{number} Пара</u> - <i>{bells}</i>: {", ".join(rooms) if rooms else "свободных аудиторий нет"}""")
+    if indexed < total:
+        parts.append(f"""\n\n<i>Учтены расписания {indexed} из {total} аудиторий</i>""")
+    msg = "".join(parts)
+    # telegram message length limit
+    if len(msg) > 4096:
+        # cut after the last room that fits, at line end if there is no comma, hard cut if there is neither
+        cut = msg.rfind(",", 0, 4000)
+        if cut == -1:
+            cut = msg.rfind("\n", 0, 4000)
+        msg = msg[:cut if cut != -1 else 4000] + " ..."
+    return msg
+
+# list of saved schedule versions, `versions` is [(update_time, first fetched, last fetched)] newest first
+def format_history(source: str, versions: list) -> str:
+    if not versions:
+        return f"""Сохранённых версий расписания группы <b>{source}</b> пока нет"""
+    parts = [f"""Версии расписания группы <b>{source}</b>:\n"""]
+    for n, (update_time, first_fetched, fetched) in enumerate(versions, 1):
+        parts.append(f"""\n{n}. {update_time} - <i>получено {time.strftime("%d.%m.%Y %H:%M", time.localtime(first_fetched))}</i>""")
+    parts.append("\n\nПосмотреть версию - /history <i>номер</i>")
+    return "".join(parts)
+
+# message about schedule changes, `diff` is notifier.schedule_diff() result
+def format_schedule_diff(source_type: Literal["group", "lecturer", "room"], source: str, diff: list, update_time: str) -> str:
+    parts = [f"""Изменения: {titles[source_type].lower()} <b>{source}</b>\n"""]
+
+    for date, weekday, removed, added, is_new in diff:
+        parts.append(f"""\n{date} - <b>{weekday}</b>{" (новый день)" if is_new else ""}\n""")
+        for lesson in removed:
+            parts.append(f"""➖ <s>{format_lesson(source_type, lesson)}</s>\n""")
+        for lesson in added:
+            parts.append(f"""➕ {format_lesson(source_type, lesson)}\n""")
+
+    parts.append(f"""\n<i>{update_time}</i>\nОтключить уведомления - /notify""")
+    msg = "".join(parts)
+    # telegram message length limit
+    if len(msg) > 4096:
+        msg = msg[:msg.rfind("\n", 0, 4000)] + "\n...\n\nПолное расписание - /schedule"
+    return msg
@@ -0,0 +1,129 @@
+import time, threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Tuple
+
+# in-process metrics: latency histograms, counters and gauges
+# exported in prometheus text format on /metrics (webhook mode) and summarized by /stats
+
+# histogram bucket upper bounds, seconds
+buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+started = time.time()
+lock = threading.Lock()
+
+class Histogram:
+    """Latency histogram with fixed buckets"""
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        # last one is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        i = 0
+        while i < len(buckets) and seconds > buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of bucket that holds `q` quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for i, n in enumerate(self.counts):
+            total += n
+            if total >= rank:
+                return buckets[i] if i < len(buckets) else float("inf")
+        return float("inf")
+
+# (stage, label) -> Histogram
+histograms: Dict[Tuple[str, str], Histogram] = dict()
+# (name, label) -> count
+counters: Dict[Tuple[str, str], int] = dict()
+# name -> function returning current value, for queue depths
+gauges: Dict[str, Callable[[], float]] = dict()
+
+def observe(stage: str, seconds: float, label: str = "") -> None:
+    with lock:
+        h = histograms.get((stage, label))
+        if h is None:
+            h = histograms[(stage, label)] = Histogram()
+        h.observe(seconds)
+
+def inc(name: str, label: str = "", n: int = 1) -> None:
+    with lock:
+        counters[(name, label)] = counters.get((name, label), 0) + n
+
+def gauge(name: str, func: Callable[[], float]) -> None:
+    gauges[name] = func
+
+@contextmanager
+def timed(stage: str, label: str = "") -> Iterator[None]:
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - t, label)
+
+# hits / (hits + misses) of counter with "hit" and "miss" labels
+def hit_rate(name: str) -> float:
+    with lock:
+        hits = sum(v for (n, label), v in counters.items() if n == name and label in ("hit", "fresh", "stale", "fallback"))
+        total = sum(v for (n, _), v in counters.items() if n == name)
+    return hits / total if total else 0.0
+
+def read_gauges() -> Dict[str, float]:
+    result = dict()
+    for name, func in list(gauges.items()):
+        try:
+            result[name] = func()
+        except Exception:
+            result[name] = -1
+    return result
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# all metrics in prometheus text format
+def render_prometheus() -> str:
+    with lock:
+        hist = {key: (list(h.counts), h.count, h.sum) for key, h in histograms.items()}
+        count = dict(counters)
+    lines = ["# TYPE kitisbot_uptime_seconds gauge", f"kitisbot_uptime_seconds {time.time() - started:.0f}"]
+
+    lines.append("# TYPE kitisbot_stage_seconds histogram")
+    for (stage, label), (counts, n, total) in sorted(hist.items()):
+        labels = f'stage="{escape(stage)}",label="{escape(label)}"'
+        cumulative = 0
+        for i, c in enumerate(counts):
+            cumulative += c
+            le = str(buckets[i]) if i < len(buckets) else "+Inf"
+            lines.append(f'kitisbot_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"kitisbot_stage_seconds_count{{{labels}}} {n}")
+        lines.append(f"kitisbot_stage_seconds_sum{{{labels}}} {total:.6f}")
+
+    lines.append("# TYPE kitisbot_events_total counter")
+    for (name, label), value in sorted(count.items()):
+        lines.append(f'kitisbot_events_total{{name="{escape(name)}",label="{escape(label)}"}} {value}')
+
+    lines.append("# TYPE kitisbot_queue_depth gauge")
+    for name, value in sorted(read_gauges().items()):
+        lines.append(f'kitisbot_queue_depth{{queue="{escape(name)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+# {(stage, label): (count, p50, p95, average)} for /stats
+def summary() -> Dict[Tuple[str, str], Tuple[int, float, float, float]]:
+    with lock:
+        return {
+            key: (h.count, h.quantile(0.5), h.quantile(0.95), h.sum / h.count if h.count else 0.0)
+            for key, h in histograms.items()
+        }
+
+def counter_values(name: str) -> Dict[str, int]:
+    with lock:
+        return {label: v for (n, label), v in counters.items() if n == name}
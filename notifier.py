@@ -0,0 +1,51 @@
+from typing import Literal
+from logger import log
+import kitis_api as api
+import messages
+import broadcast
+
+# pushes schedule changes to users subscribed to their group
+# diff is rendered once per group and then sent to every subscriber
+
+db = None
+
+# returns [(date, weekday, removed lessons, added lessons, is new day)] for days that changed
+# days that disappeared (past days) are not changes
+def schedule_diff(old: dict, new: dict) -> list:
+    result = list()
+    for date, info in new["days"].items():
+        old_info = old["days"].get(date)
+        if old_info is None:
+            if info["lessons"]:
+                result.append((date, info["weekday"], [], list(info["lessons"]), True))
+            continue
+        if old_info["lessons"] == info["lessons"]:
+            continue
+        removed = [lesson for lesson in old_info["lessons"] if lesson not in info["lessons"]]
+        added   = [lesson for lesson in info["lessons"] if lesson not in old_info["lessons"]]
+        if removed or added:
+            result.append((date, info["weekday"], removed, added, False))
+    return result
+
+# api schedule listener
+def on_schedule_change(source_type: Literal["group", "lecturer", "room"], source: str, old: dict, new: dict) -> None:
+    if source_type != "group":
+        return
+    diff = schedule_diff(old, new)
+    if not diff:
+        log("trash", f"Notifier: {source} got new update time, but lessons did not change")
+        return
+
+    subscribers = db.get_subscribers(source)
+    log("info", f"Notifier: schedule of {source} changed ({len(diff)} days), notifying {len(subscribers)} users")
+    if not subscribers:
+        return
+    text = messages.format_schedule_diff(source_type, source, diff, new["update_time"])
+    # sent in background with telegram limits
+    broadcast.start_broadcast(text, "", None, subscribers)
+
+def init_notifier(database) -> None:
+    global db
+
+    db = database
+    api.schedule_listeners.append(on_schedule_change)
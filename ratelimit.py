@@ -0,0 +1,112 @@
+import time, threading
+from logger import log
+
+class TokenBucket:
+    """Token bucket, `rate` tokens per second, up to `capacity` tokens at once"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        """Take tokens if there are enough of them, never blocks"""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Take tokens, waiting for them if needed"""
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+class RateLimiter:
+    """In-memory per-user limiter with separate budget for each command and one global budget.
+    `budgets` is {command: (tokens per second, burst)}. Time of last allowed request of every user
+    is kept in memory and written to database only by flush() (last_<command>_request_time columns).
+    Commands in `volatile` are limited only in memory, they have no database column"""
+
+    def __init__(self, budgets: dict, global_rate: float, global_burst: float, loader=None, volatile=()):
+        self.budgets = budgets
+        self.volatile = set(volatile)
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        # (uid, command) -> [tokens, last update, last allowed request time]
+        self.buckets = dict()
+        # buckets with request times not written to database yet
+        self.dirty = set()
+        # loader(uid, command) returns last request time from database for users without bucket
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def check(self, uid: int, command: str) -> str:
+        """Takes one token. Returns "" if request is allowed,
+        "user" if user is too fast or "global" if bot in general is too busy"""
+        key = (uid, command)
+        rate, burst = self.budgets[command]
+        # loader may touch database, so it is called outside lock
+        last = self.loader(uid, command) if self.loader and command not in self.volatile and key not in self.buckets else 0
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                # after restart user only gets tokens refilled since his last request
+                tokens = burst if not last else min(burst, max(0, (time.time() - last) * rate))
+                bucket = [tokens, now, last]
+                self.buckets[key] = bucket
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return "user"
+            if not self.global_bucket.try_acquire():
+                return "global"
+            bucket[0] -= 1
+            bucket[2] = time.time()
+            self.dirty.add(key)
+        return ""
+
+    def flush(self, db) -> None:
+        """Write last request times to database and forget idle buckets"""
+        with self.lock:
+            by_command = dict()
+            for key in self.dirty:
+                if key[1] in self.volatile:
+                    continue
+                by_command.setdefault(key[1], []).append((self.buckets[key][2], key[0]))
+            self.dirty.clear()
+            # full buckets are the same as missing ones
+            now = time.monotonic()
+            for key, bucket in list(self.buckets.items()):
+                rate, burst = self.budgets[key[1]]
+                if bucket[0] + (now - bucket[1]) * rate >= burst:
+                    del self.buckets[key]
+        for command, values in by_command.items():
+            db.set_values(f"last_{command}_request_time", values)
+
+    def start_flusher(self, db, interval: float) -> None:
+        def loop():
+            while not self.stop_event.wait(interval):
+                try:
+                    self.flush(db)
+                except Exception as e:
+                    log("fail", f"Rate limiter: flush failed: {e}")
+        threading.Thread(target=loop, name="ratelimit-flush", daemon=True).start()
+
+    def stop(self, db) -> None:
+        self.stop_event.set()
+        self.flush(db)
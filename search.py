@@ -0,0 +1,94 @@
+import re, bisect, threading
+from typing import Dict, List, Literal, Set, Tuple
+from logger import log
+
+# search over group, lecturer and room names for inline mode
+# index is rebuilt on every links refresh:
+# - sorted word list for prefix matches ("иван" finds "Иванов И.И.")
+# - trigram index for typos ("ивнов" still finds "Иванов И.И.")
+
+re_word = re.compile(r"\w+")
+
+# entry id -> (source_type, name)
+entries: List[Tuple[str, str]] = []
+# entry id -> normalized name
+normalized: List[str] = []
+# sorted (word, entry id) of every word of every name
+words: List[Tuple[str, int]] = []
+# trigram -> entry ids
+trigrams: Dict[str, Set[int]] = dict()
+index_lock = threading.Lock()
+
+# minimal share of query trigrams found in name for typo match
+min_similarity: float = 0.4
+
+def normalize(text: str) -> str:
+    return " ".join(re_word.findall(text.casefold().replace("ё", "е")))
+
+def make_trigrams(text: str) -> Set[str]:
+    # spaces around words, so short words and word starts get trigrams too
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# api links listener
+def build_index(links: dict) -> None:
+    new_entries = []
+    new_normalized = []
+    new_words = []
+    new_trigrams: Dict[str, Set[int]] = dict()
+    for source_type in ("group", "lecturer", "room"):
+        for name in (links.get(f"s_{source_type}") or {}):
+            n = len(new_entries)
+            text = normalize(name)
+            new_entries.append((source_type, name))
+            new_normalized.append(text)
+            new_words.extend((word, n) for word in text.split())
+            for trigram in make_trigrams(text):
+                new_trigrams.setdefault(trigram, set()).add(n)
+    new_words.sort()
+
+    global entries, normalized, words, trigrams
+    with index_lock:
+        entries, normalized, words, trigrams = new_entries, new_normalized, new_words, new_trigrams
+    log("trash", f"Search index built: {len(new_entries)} names")
+
+# returns [(source_type, name)] best matches first
+def find(query: str, limit: int = 20) -> List[Tuple[Literal["group", "lecturer", "room"], str]]:
+    text = normalize(query)
+    if not text:
+        return []
+    with index_lock:
+        e, norm, w, tri = entries, normalized, words, trigrams
+
+    # score is (kind, similarity), kind: 0 - whole name prefix, 1 - every query word is prefix of some word, 2 - typo
+    scores: Dict[int, Tuple[int, float]] = dict()
+    query_words = text.split()
+
+    # every query word must be a prefix of some word of the name
+    matched = None
+    for word in query_words:
+        ids = set()
+        i = bisect.bisect_left(w, (word, -1))
+        while i < len(w) and w[i][0].startswith(word):
+            ids.add(w[i][1])
+            i += 1
+        matched = ids if matched is None else matched & ids
+        if not matched:
+            break
+    for n in matched or ():
+        scores[n] = (0 if norm[n].startswith(text) else 1, 0.0)
+
+    # typo tolerant match by share of common trigrams
+    if len(scores) < limit:
+        query_trigrams = make_trigrams(text)
+        counts: Dict[int, int] = dict()
+        for trigram in query_trigrams:
+            for n in tri.get(trigram, ()):
+                counts[n] = counts.get(n, 0) + 1
+        for n, count in counts.items():
+            similarity = count / len(query_trigrams)
+            if n not in scores and similarity >= min_similarity:
+                scores[n] = (2, -similarity)
+
+    best = sorted(scores.items(), key=lambda item: (item[1], len(norm[item[0]]), norm[item[0]]))[:limit]
+    return [e[n] for n, _ in best]
@@ -0,0 +1,73 @@
+import json, time, threading
+from typing import Literal, Optional
+from logger import log
+import kitis_api as api
+import lessons
+
+# saves every parsed schedule to database, so after restart bot serves them right away
+# and refreshes them in background instead of hitting the site with every first request
+# every new update_time is saved as a new version, so old schedules can be looked up
+
+db = None
+# schedules older than this are not restored on startup (seconds)
+restore_max_age: float = 7 * 86400
+# versions not fetched for this long are deleted (seconds)
+history_max_age: float = 60 * 86400
+# old versions are deleted this often (seconds), new versions keep coming while bot runs
+prune_interval: float = 86400
+stop_event = threading.Event()
+
+# (source_type, source) -> update_time of the last saved version, so same version is not serialized again
+saved = dict()
+saved_lock = threading.Lock()
+
+# api cache listener
+def on_cache(source_type: Literal["group", "lecturer", "room"], source: str, data: dict, fetched: float) -> None:
+    key = (source_type, source)
+    with saved_lock:
+        same = saved.get(key) == data["update_time"]
+        saved[key] = data["update_time"]
+    if same:
+        db.touch_schedule(source_type, source, data["update_time"], fetched)
+    else:
+        db.save_schedule(source_type, source, data["update_time"], fetched, json.dumps(data, ensure_ascii=False, default=dict))
+
+# puts saved schedules into api cache, returns number of restored schedules
+def restore() -> int:
+    rows = db.get_latest_schedules(time.time() - restore_max_age)
+    for source_type, source, update_time, fetched, data in rows:
+        with saved_lock:
+            saved[(source_type, source)] = update_time
+        api.restore_schedule(source_type, source, json.loads(data), fetched)
+    return len(rows)
+
+# schedule as it was at `timestamp`, None if it was not saved back then
+def schedule_at(source_type: Literal["group", "lecturer", "room"], source: str, timestamp: float) -> Optional[dict]:
+    data = db.get_schedule_at(source_type, source, timestamp)
+    return lessons.compact_schedule(source_type, json.loads(data)) if data else None
+
+# (update_time, first fetched, last fetched) of saved versions, newest first
+def history(source_type: Literal["group", "lecturer", "room"], source: str) -> list:
+    return db.get_schedule_history(source_type, source)
+
+def prune() -> None:
+    db.prune_schedules(time.time() - history_max_age)
+
+def prune_loop() -> None:
+    while not stop_event.wait(prune_interval):
+        try:
+            prune()
+        except Exception as e:
+            log("fail", f"Snapshots: prune failed: {e}")
+
+def init_snapshots(database, restore_age: float = restore_max_age, history_age: float = history_max_age, prune_every: float = prune_interval) -> None:
+    global db, restore_max_age, history_max_age, prune_interval
+
+    db = database
+    restore_max_age = restore_age
+    history_max_age = history_age
+    prune_interval = prune_every
+    prune()
+    threading.Thread(target=prune_loop, name="snapshots-prune", daemon=True).start()
+    log("ok", f"Restored {restore()} saved schedules")
+    api.cache_listeners.append(on_cache)
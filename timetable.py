@@ -0,0 +1,75 @@
+import re, datetime, threading
+from typing import Dict, List, Literal, Optional, Tuple
+import kitis_api as api
+
+# date-scoped views of schedules: /today, /tomorrow, /week and next lesson
+# per-date index is built once per parsed schedule (per update_time), slices are taken from it
+
+re_bell = re.compile(r"(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})")
+
+# (source_type, source) -> (update_time, {date: (date string, day info)})
+indexes: Dict[Tuple[str, str], Tuple[str, Dict[datetime.date, Tuple[str, dict]]]] = dict()
+indexes_lock = threading.Lock()
+
+def parse_date(date: str) -> Optional[datetime.date]:
+    try:
+        return datetime.datetime.strptime(date, "%d.%m.%Y").date()
+    except ValueError:
+        return None
+
+def build_index(data: dict) -> Dict[datetime.date, Tuple[str, dict]]:
+    index = dict()
+    for date, info in data["days"].items():
+        d = parse_date(date)
+        if d is not None:
+            index[d] = (date, info)
+    return index
+
+# api cache listener, index is ready before anyone asks
+def on_cache(source_type: Literal["group", "lecturer", "room"], source: str, data: dict, fetched: float) -> None:
+    get_index(source_type, source, data)
+
+def get_index(source_type: Literal["group", "lecturer", "room"], source: str, data: dict) -> Dict[datetime.date, Tuple[str, dict]]:
+    key = (source_type, source)
+    with indexes_lock:
+        entry = indexes.get(key)
+    if entry and entry[0] == data["update_time"]:
+        return entry[1]
+    index = build_index(data)
+    with indexes_lock:
+        indexes[key] = (data["update_time"], index)
+    return index
+
+# (date string, day info) of every published day of the week with `day`, Monday to Sunday
+def week_days(index: dict, day: datetime.date) -> List[Tuple[str, dict]]:
+    monday = day - datetime.timedelta(days=day.weekday())
+    return [index[d] for d in (monday + datetime.timedelta(days=n) for n in range(7)) if d in index]
+
+# [(start, end)] in minutes since midnight for lesson number, monday has its own bells
+# first lesson on monday has two parts, they are both returned
+def lesson_times(weekday: str, number: str) -> List[Tuple[int, int]]:
+    bells = api.t_bells_monday if weekday == "Понедельник" else api.t_bells_week
+    return [
+        (int(h1) * 60 + int(m1), int(h2) * 60 + int(m2))
+        for h1, m1, h2, m2 in re_bell.findall(bells.get(number, ""))
+    ]
+
+# (date string, weekday, lesson, is it going right now) of the next lesson after `now`, None if there are none
+# lessons are compared by bell times, not by number: second part of monday first lesson is after fifth one
+def next_lesson(index: dict, now: datetime.datetime) -> Optional[Tuple[str, str, dict, bool]]:
+    today = now.date()
+    minutes = now.hour * 60 + now.minute
+    for d in sorted(d for d in index if d >= today):
+        date, info = index[d]
+        best = None
+        for lesson in info["lessons"]:
+            for start, end in lesson_times(info["weekday"], lesson["number"]):
+                if d == today and end <= minutes:
+                    continue
+                ongoing = d == today and start <= minutes
+                key = -1 if ongoing else start
+                if best is None or key < best[0]:
+                    best = (key, lesson, ongoing)
+        if best:
+            return date, info["weekday"], best[1], best[2]
+    return None